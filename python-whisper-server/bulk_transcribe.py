@@ -0,0 +1,412 @@
+"""批量转写：按目录 glob 或 JSONL 清单转写本地音频归档
+
+用法示例:
+  python bulk_transcribe.py "archive/**/*.wav" -o results.jsonl --workers 4
+  python bulk_transcribe.py manifest.jsonl -o results.parquet --model base
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from inference import custom_load_audio
+from transcription import parse_tasks, transcribe_bulk
+
+# 清单中文件路径可以使用的字段名，按顺序查找
+MANIFEST_PATH_KEYS = ("filePath", "path", "file")
+
+# 清单中条目 ID 可以使用的字段名，缺省时使用文件路径
+MANIFEST_ID_KEYS = ("id", "request_id")
+
+# Parquet 输出的列，chunks 和多任务结果 tasks 以 JSON 字符串保存
+PARQUET_COLUMNS = [
+    "id", "filePath", "success", "text", "chunks", "language",
+    "duration", "model", "processingTime", "timestamp", "error", "tasks"
+]
+PARQUET_JSON_COLUMNS = ("chunks", "tasks")
+
+
+def iter_bulk_inputs(source: str) -> Iterator[Dict[str, Any]]:
+    """从目录、glob 模式或 JSONL 清单中逐条产出待转写条目，不会一次性展开整个归档"""
+    if source.endswith(".jsonl") and os.path.isfile(source):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                file_path = next((entry[k] for k in MANIFEST_PATH_KEYS if entry.get(k)), None)
+                if not file_path:
+                    raise ValueError(f"清单第 {line_no} 行缺少文件路径字段，可用字段: {list(MANIFEST_PATH_KEYS)}")
+                if not os.path.isabs(file_path):
+                    file_path = os.path.join(base_dir, file_path)
+                file_path = os.path.abspath(file_path)
+                entry_id = next((entry[k] for k in MANIFEST_ID_KEYS if entry.get(k)), file_path)
+                yield {
+                    "id": str(entry_id),
+                    "filePath": file_path,
+                    "options": entry.get("options") or {}
+                }
+        return
+
+    pattern = source
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*.wav")
+
+    for file_path in glob.iglob(pattern, recursive=True):
+        if os.path.isfile(file_path):
+            file_path = os.path.abspath(file_path)
+            yield {"id": file_path, "filePath": file_path, "options": {}}
+
+
+class JsonlSink:
+    """JSONL 结果输出，每条结果写完立即 flush，进程中断后可续跑"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def completed_ids(self) -> Set[str]:
+        """读取已有输出中成功完成的条目 ID"""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 上次中断时可能留下半行，忽略即可
+                    continue
+                if record.get("success"):
+                    done.add(record["id"])
+        return done
+
+    def open(self, resume: bool):
+        # 如果上次中断在半行处，先补一个换行，避免新结果和残行拼在一起
+        needs_newline = False
+        if resume and os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink:
+    """Parquet 结果输出，按 row group 增量写入
+
+    每个 row group 写成 <output>.parts/ 下一个独立的 part 文件（先写临时文件再改名，落盘即完整），
+    进程中断后续跑时会读取这些 part 文件；正常结束时把已有结果和全部 part 合并为 output 文件。
+    """
+
+    def __init__(self, path: str, row_group_size: int = 64):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("Parquet 输出需要安装 pyarrow: pip install pyarrow") from e
+
+        self.path = path
+        self.row_group_size = row_group_size
+        self._lock = threading.Lock()
+        self._rows = []
+        self._parts_dir = path + ".parts"
+        self._next_part = 0
+        self._resume = True
+        self._opened = False
+
+    def _schema(self):
+        import pyarrow as pa
+        return pa.schema([
+            ("id", pa.string()),
+            ("filePath", pa.string()),
+            ("success", pa.bool_()),
+            ("text", pa.string()),
+            ("chunks", pa.string()),
+            ("language", pa.string()),
+            ("duration", pa.float64()),
+            ("model", pa.string()),
+            ("processingTime", pa.int64()),
+            ("timestamp", pa.string()),
+            ("error", pa.string()),
+            ("tasks", pa.string()),
+        ])
+
+    def _read(self, path: str):
+        """读取已有结果并对齐到当前的列，旧版本输出缺少的列补为空"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        for field in self._schema():
+            if field.name not in table.column_names:
+                table = table.append_column(field, pa.nulls(len(table), field.type))
+        return table.select(PARQUET_COLUMNS).cast(self._schema())
+
+    def _part_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self._parts_dir, "part-*.parquet")))
+
+    def completed_ids(self) -> Set[str]:
+        import pyarrow.parquet as pq
+        done = set()
+        paths = [self.path] if os.path.exists(self.path) else []
+        for path in paths + self._part_paths():
+            table = pq.read_table(path, columns=["id", "success"])
+            done.update(
+                row_id for row_id, success in zip(table.column("id").to_pylist(), table.column("success").to_pylist())
+                if success
+            )
+        return done
+
+    def open(self, resume: bool):
+        if not resume and os.path.isdir(self._parts_dir):
+            shutil.rmtree(self._parts_dir)
+        os.makedirs(self._parts_dir, exist_ok=True)
+        existing = self._part_paths()
+        # 接着上次中断时的编号继续写
+        self._next_part = int(os.path.basename(existing[-1])[5:-8]) + 1 if existing else 0
+        self._resume = resume
+        self._opened = True
+
+    def write(self, record: Dict[str, Any]):
+        row = {column: record.get(column) for column in PARQUET_COLUMNS}
+        for column in PARQUET_JSON_COLUMNS:
+            if row[column] is not None:
+                row[column] = json.dumps(row[column], ensure_ascii=False)
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.row_group_size:
+                self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self._rows:
+            part_path = os.path.join(self._parts_dir, f"part-{self._next_part:06d}.parquet")
+            pq.write_table(pa.Table.from_pylist(self._rows, schema=self._schema()), part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+            self._next_part += 1
+            self._rows = []
+
+    def close(self):
+        import pyarrow.parquet as pq
+        if not self._opened:
+            return
+        with self._lock:
+            self._flush()
+            self._opened = False
+
+        tmp_path = self.path + ".partial"
+        writer = pq.ParquetWriter(tmp_path, self._schema())
+        try:
+            if self._resume and os.path.exists(self.path):
+                writer.write_table(self._read(self.path))
+            for part_path in self._part_paths():
+                writer.write_table(self._read(part_path))
+        finally:
+            writer.close()
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self._parts_dir)
+
+
+def open_sink(path: str):
+    """根据扩展名选择输出格式"""
+    if path.endswith(".parquet"):
+        return ParquetSink(path)
+    return JsonlSink(path)
+
+
+def run_bulk(
+    source: str,
+    output: str,
+    transcribe_fn: Callable,
+    load_fn: Callable,
+    options: Optional[Dict[str, Any]] = None,
+    workers: int = 2,
+    resume: bool = True,
+    stats: Optional[Dict[str, Any]] = None,
+    stop_event: Optional[threading.Event] = None
+) -> Dict[str, Any]:
+    """批量转写主流程
+
+    workers 个线程并行解码音频；推理在 transcribe_fn 内部按模型串行，
+    所以下一个文件的解码会和当前文件的推理重叠。每个结果写完立即落盘。
+    transcribe_fn 通常是 transcribe_bulk：超出限额时等待令牌补足，而不是把文件记为失败。
+    """
+    options = options or {}
+    workers = max(1, int(workers))
+    stats = stats if stats is not None else {}
+    stats.update({"total": 0, "skipped": 0, "successful": 0, "failed": 0, "audioSeconds": 0.0})
+
+    sink = open_sink(output)
+    done_ids = sink.completed_ids() if resume else set()
+    sink.open(resume)
+    print(f"📂 批量转写开始: {source} → {output}，并行度: {workers}，已完成: {len(done_ids)}")
+
+    # 限制在途任务数量，避免一次性把整个归档的解码结果堆在内存里
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    stats_lock = threading.Lock()
+    start_time = time.time()
+
+    def process(entry: Dict[str, Any]):
+        try:
+            merged_options = {**options, **entry["options"]}
+            try:
+                # 清单里的 tasks 可以是 "transcribe,translate:en" 字符串或列表，格式错误时该条目记为失败
+                merged_options["tasks"] = parse_tasks(merged_options.get("tasks"), merged_options.get("language", "zh"))
+                audio = load_fn(entry["filePath"])
+                result, processing_time = transcribe_fn(audio, merged_options)
+                duration = len(audio) / 16000
+                record = {
+                    "id": entry["id"],
+                    "filePath": entry["filePath"],
+                    "success": True,
+                    "text": result["text"],
+                    "chunks": result["segments"],
+                    "language": result["language"],
+                    "duration": duration,
+                    "model": result["routing"]["model"] if "routing" in result else merged_options.get("model", "tiny"),
+                    "processingTime": int(processing_time * 1000),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "tasks": result.get("tasks")
+                }
+            except Exception as e:
+                print(f"❌ 文件处理失败: {entry['filePath']}: {e}")
+                duration = 0
+                record = {
+                    "id": entry["id"],
+                    "filePath": entry["filePath"],
+                    "success": False,
+                    "error": str(e),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                }
+
+            sink.write(record)
+            with stats_lock:
+                stats["successful" if record["success"] else "failed"] += 1
+                stats["audioSeconds"] += duration
+        finally:
+            in_flight.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk") as executor:
+            for entry in iter_bulk_inputs(source):
+                if stop_event is not None and stop_event.is_set():
+                    print("⏹️  批量转写已停止")
+                    break
+                with stats_lock:
+                    stats["total"] += 1
+                if entry["id"] in done_ids:
+                    with stats_lock:
+                        stats["skipped"] += 1
+                    continue
+                in_flight.acquire()
+                executor.submit(process, entry)
+    finally:
+        sink.close()
+
+    stats["processingTime"] = int((time.time() - start_time) * 1000)
+    print(f"✅ 批量转写完成: 成功 {stats['successful']}，失败 {stats['failed']}，跳过 {stats['skipped']}")
+    return stats
+
+
+class BulkJob:
+    """HTTP 接口发起的后台批量转写任务"""
+
+    def __init__(self, source: str, output: str, options: Dict[str, Any], workers: int, resume: bool):
+        self.id = uuid.uuid4().hex
+        self.source = source
+        self.output = output
+        self.options = options
+        self.workers = workers
+        self.resume = resume
+        self.status = "pending"
+        self.error = None
+        self.stats: Dict[str, Any] = {}
+        self.started_at = None
+        self.finished_at = None
+        self.stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, transcribe_fn: Callable, load_fn: Callable):
+        def run():
+            self.status = "running"
+            self.started_at = time.time()
+            try:
+                run_bulk(
+                    self.source, self.output, transcribe_fn, load_fn,
+                    options=self.options, workers=self.workers, resume=self.resume,
+                    stats=self.stats, stop_event=self.stop_event
+                )
+                self.status = "stopped" if self.stop_event.is_set() else "completed"
+            except Exception as e:
+                print(f"❌ 批量转写任务失败: {e}")
+                self.status = "failed"
+                self.error = str(e)
+            finally:
+                self.finished_at = time.time()
+
+        self._thread = threading.Thread(target=run, name=f"bulk-{self.id[:8]}", daemon=True)
+        self._thread.start()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("pending", "running")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "source": self.source,
+            "output": self.output,
+            "workers": self.workers,
+            "resume": self.resume,
+            "stats": dict(self.stats),
+            "error": self.error,
+            "elapsed": int(((self.finished_at or time.time()) - self.started_at) * 1000) if self.started_at else 0
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量转写本地音频归档（目录 glob 或 JSONL 清单）")
+    parser.add_argument("source", help="目录、glob 模式（如 'archive/**/*.wav'）或 JSONL 清单")
+    parser.add_argument("-o", "--output", required=True, help="结果输出文件，.jsonl 或 .parquet")
+    parser.add_argument("--model", default="tiny", help="使用的模型")
+    parser.add_argument("--language", default="zh", help="语言")
+    parser.add_argument("--subtask", default="transcribe", help="任务: transcribe 或 translate")
+    parser.add_argument("--workers", type=int, default=2, help="并行解码的线程数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有输出，从头开始")
+    args = parser.parse_args()
+
+    stats = run_bulk(
+        args.source, args.output, transcribe_bulk, custom_load_audio,
+        options={"model": args.model, "language": args.language, "subtask": args.subtask},
+        workers=args.workers, resume=not args.no_resume
+    )
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""推理的协作式取消：客户端断开或超过 timeoutMs 截止时间后，在 30 秒窗口之间停止解码
+
+推理线程在每个窗口解码前检查 CancelToken，被取消时抛出 InferenceCancelled，
+调度器的推理槽、共享内存块等资源沿异常路径正常释放。
+"""
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# 等待推理结果时检查客户端连接和截止时间的间隔（秒）
+CANCEL_POLL_SECONDS = 0.5
+
+# 取消原因
+REASON_DISCONNECTED = "disconnected"
+REASON_DEADLINE = "deadline"
+
+
+class InferenceCancelled(Exception):
+    """推理被取消；processed_seconds 为取消前已解码的音频时长"""
+
+    def __init__(self, reason: str, processed_seconds: float = 0.0):
+        super().__init__(reason, processed_seconds)
+        self.reason = reason
+        self.processed_seconds = processed_seconds
+
+    def __str__(self) -> str:
+        if self.reason == REASON_DEADLINE:
+            return "转写超过客户端指定的 timeoutMs，已停止"
+        return "客户端已断开连接，转写已停止"
+
+
+class CancelToken:
+    """请求的取消标记，在事件循环中设置，在推理线程中检查"""
+
+    def __init__(self, timeout_ms: Optional[int] = None):
+        self.deadline = time.time() + timeout_ms / 1000 if timeout_ms else None
+        self.reason: Optional[str] = None
+        self.processed_seconds = 0.0  # 由进度回调更新，用于统计取消时未解码的音频时长
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    def cancelled_reason(self) -> Optional[str]:
+        if self.reason is None and self.deadline is not None and time.time() >= self.deadline:
+            self.reason = REASON_DEADLINE
+        return self.reason
+
+    def check(self):
+        reason = self.cancelled_reason()
+        if reason is not None:
+            raise InferenceCancelled(reason, self.processed_seconds)
+
+
+# 当前线程正在执行的转写对应的取消标记
+cancel_state = threading.local()
+
+
+class CancellationStats:
+    def __init__(self):
+        self.cancelled: Dict[str, int] = {REASON_DISCONNECTED: 0, REASON_DEADLINE: 0}
+        self.cancelled_seconds = 0.0  # 因取消而没有解码的音频时长
+        self.decoded_seconds = 0.0  # 取消前已经解码、被丢弃的音频时长
+        self._lock = threading.Lock()
+
+    def record(self, reason: str, audio_seconds: float, processed_seconds: float):
+        processed_seconds = min(processed_seconds, audio_seconds)
+        with self._lock:
+            self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+            self.cancelled_seconds += audio_seconds - processed_seconds
+            self.decoded_seconds += processed_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cancelled": dict(self.cancelled),
+                "cancelledAudioSeconds": round(self.cancelled_seconds, 2),
+                "discardedAudioSeconds": round(self.decoded_seconds, 2)
+            }
+
+
+cancellation_stats = CancellationStats()
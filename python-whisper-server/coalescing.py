@@ -0,0 +1,90 @@
+"""进行中请求合并：相同音频内容 + 相同选项的并发请求共享同一次推理"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional
+
+from cancellation import REASON_DISCONNECTED, CancelToken
+from scheduler import RateLimitExceeded, run_inference
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def coalesce_key(content_hash: str, options: Dict[str, Any]) -> str:
+    """由音频内容哈希和转写选项组成合并键"""
+    return content_hash + ":" + json.dumps(options, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class InflightCoalescer:
+    """客户端超时重试时，原请求往往还在推理；重试请求直接挂到正在进行的计算上，拿到同一个结果"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tokens: Dict[str, CancelToken] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats = {
+            "leaders": 0,      # 实际发起推理的请求数
+            "coalesced": 0,    # 挂到已有推理上的请求数
+            "inflight": 0      # 当前正在进行的推理数
+        }
+
+    async def run(self, key: str, fn: Callable, *args, cancel: Optional[CancelToken] = None) -> Any:
+        """在推理线程池中执行 fn(*args)；相同 key 的计算正在进行时直接等待它的结果
+
+        传入 cancel 时以 fn(*args, cancel=...) 调用，计算使用所有等待方共享的取消标记：
+        只有全部等待方都离开后才取消计算，取消原因取自最后离开的等待方的 cancel。
+        限流按请求在合并前检查；计算本身被限流时，该限额属于发起方，合并进来的请求重新发起自己的计算
+        """
+        future = self._inflight.get(key)
+        if future is not None and (future.done() or key in self._tokens and self._tokens[key].reason is not None):
+            # 已结束，或已被取消、正在收尾的计算不能再合并，重新发起
+            future = None
+        leader = future is None
+        if not leader:
+            self.stats["coalesced"] += 1
+            print(f"🔗 相同音频和选项的转写正在进行，合并请求（累计合并 {self.stats['coalesced']} 次）")
+        else:
+            self._tokens.pop(key, None)
+            if cancel is not None:
+                self._tokens[key] = CancelToken()
+                future = asyncio.ensure_future(run_inference(fn, *args, cancel=self._tokens[key]))
+            else:
+                future = asyncio.ensure_future(run_inference(fn, *args))
+            self._inflight[key] = future
+            self._waiters[key] = 0
+            self.stats["leaders"] += 1
+            self.stats["inflight"] += 1
+            future.add_done_callback(lambda f: self._finish(key, f))
+
+        # shield：某个等待方被取消时不影响其他等待方和计算本身
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(future)
+        except RateLimitExceeded:
+            if leader:
+                raise
+            return await self.run(key, fn, *args, cancel=cancel)
+        except asyncio.CancelledError:
+            if not future.done() and self._inflight.get(key) is future:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and key in self._tokens:
+                    self._tokens[key].cancel(cancel.reason if cancel is not None and cancel.reason else REASON_DISCONNECTED)
+            raise
+
+    def _finish(self, key: str, future: asyncio.Future):
+        # 被取消的计算收尾时，同一个 key 可能已经重新发起，只清理自己的记录
+        if self._inflight.get(key) is future:
+            self._inflight.pop(key, None)
+            self._tokens.pop(key, None)
+            self._waiters.pop(key, None)
+        self.stats["inflight"] -= 1
+        # 所有等待方都已离开时，避免出现 "exception was never retrieved" 警告
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,440 @@
+"""Whisper 解码钩子：按 30 秒窗口缓存编码器输出，并在解码失控时提前截断
+
+transcribe() 对每个窗口（以及每次温度回退）都会调用 model.decode()，
+而 decode() 每次都重新跑一遍编码器。这里替换模型实例上的 decode，
+先按 (模型, 窗口 mel 内容哈希) 查编码器输出缓存，命中时直接进入解码。
+同一段音频换 subtask / language 再请求，或者温度回退重解同一个窗口时，都不再重复编码。
+一个请求包含多个任务时，整段音频的 log-mel 频谱也只计算一次（reuse_mel）。
+
+静音、音乐等输入上解码器容易陷入重复，一直生成到 sample_len 上限，
+再因 compression_ratio 过高触发温度回退重解。HallucinationGuard 作为额外的 logit 过滤器，
+检测到重复 n-gram 时强制输出 EOT，并把结果中的重复部分裁剪为一次，使其不再触发回退；
+无语音概率高且平均对数概率已低于 whisper 的阈值时同样提前结束，由 whisper 按静音跳过该窗口。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+
+from cancellation import cancel_state
+
+# 编码器输出缓存的容量上限（MB），large 模型单个窗口约 7.5MB（fp32）
+ENCODER_CACHE_MB = int(os.environ.get("WHISPER_ENCODER_CACHE_MB", "256"))
+
+
+class EncoderCache:
+    """按字节数限制容量的 LRU 缓存"""
+
+    def __init__(self, max_bytes: int = ENCODER_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple):
+        with self._lock:
+            features = self._entries.get(key)
+            if features is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return features
+
+    def put(self, key: Tuple, features):
+        size = features.element_size() * features.nelement()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = features
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.element_size() * evicted.nelement()
+                self.evictions += 1
+
+    def clear(self, model_name: str = None):
+        """清空缓存；指定模型时只清该模型的条目"""
+        with self._lock:
+            for key in [k for k in self._entries if model_name is None or k[0] == model_name]:
+                features = self._entries.pop(key)
+                self.bytes -= features.element_size() * features.nelement()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0,
+                "evictions": self.evictions
+            }
+
+
+encoder_cache = EncoderCache()
+
+
+def mel_digest(mel) -> str:
+    """窗口 mel 频谱的内容哈希，相同音频窗口得到相同的键"""
+    return hashlib.blake2b(mel.detach().cpu().numpy().tobytes(), digest_size=16).hexdigest()
+
+
+def encode_with_cache(model, model_name: str, mel, fp16: bool):
+    """返回编码器输出，优先使用缓存；与 DecodingTask._get_audio_features 的精度处理保持一致"""
+    if mel.shape[-2:] == (model.dims.n_audio_ctx, model.dims.n_audio_state):
+        # 传入的已经是编码器输出
+        return mel
+    key = (model_name, fp16, tuple(mel.shape), mel_digest(mel))
+    features = encoder_cache.get(key)
+    if features is None:
+        features = model.encoder(mel.half() if fp16 else mel)
+        encoder_cache.put(key, features)
+    return features
+
+
+# 当前线程的 log-mel 频谱复用范围，见 reuse_mel()
+mel_state = threading.local()
+
+# log-mel 频谱的计算和复用次数
+mel_stats = {
+    "computed": 0,
+    "reused": 0
+}
+
+
+@contextmanager
+def reuse_mel():
+    """范围内对同一个音频数组多次调用 model.transcribe() 时，整段音频的 log-mel 频谱只计算一次"""
+    mel_state.cache = {}
+    try:
+        yield
+    finally:
+        mel_state.cache = None
+
+
+def install_mel_hook(transcribe_module):
+    """替换 whisper.transcribe 模块中的 log_mel_spectrogram，在 reuse_mel() 范围内按音频数组缓存结果
+
+    缓存以数组对象为键，只在范围内有效，范围内调用方持有该数组，不会出现对象被回收后 id 复用的情况；
+    transcribe() 只对频谱切片后读取，不会原地修改
+    """
+    original = transcribe_module.log_mel_spectrogram
+    if getattr(original, "reuses_mel", False):
+        return
+
+    def log_mel_spectrogram(audio, n_mels: int = 80, padding: int = 0, device=None):
+        cache = getattr(mel_state, "cache", None)
+        if cache is None or isinstance(audio, str):
+            mel_stats["computed"] += 1
+            return original(audio, n_mels, padding, device)
+        key = (id(audio), n_mels, padding, str(device))
+        if key in cache:
+            mel_stats["reused"] += 1
+        else:
+            mel_stats["computed"] += 1
+            cache[key] = original(audio, n_mels, padding, device)
+        return cache[key]
+
+    log_mel_spectrogram.reuses_mel = True
+    transcribe_module.log_mel_spectrogram = log_mel_spectrogram
+
+
+# 是否默认开启幻觉/重复截断，单个请求可以通过 hallucinationGuard 参数覆盖
+GUARD_DEFAULT = os.environ.get("WHISPER_HALLUCINATION_GUARD", "false").lower() == "true"
+
+# whisper.transcribe() 的默认阈值：超过压缩比或低于平均对数概率时温度回退，
+# 无语音概率高且平均对数概率低时按静音跳过窗口
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# 无语音截断前至少解码的 token 数，平均对数概率在开头几个 token 上波动较大
+NO_SPEECH_MIN_TOKENS = 4
+
+
+@dataclass
+class GuardConfig:
+    max_ngram: int = 12  # 检测的最长重复片段（token 数）
+    min_repeats: int = 4  # 片段至少连续重复的次数
+    min_span: int = 16  # 重复部分至少覆盖的 token 数，避免误伤 "no no no" 这类正常重复
+    no_speech_threshold: Optional[float] = 0.6  # 无语音概率超过该值（且不低于 whisper 的 0.6）时检测静音，None 表示不检测
+
+
+# 请求参数名与 GuardConfig 字段的对应关系
+GUARD_FIELDS = {
+    "maxNgram": "max_ngram",
+    "minRepeats": "min_repeats",
+    "minSpan": "min_span",
+    "noSpeechThreshold": "no_speech_threshold"
+}
+
+
+def parse_guard(value: Any) -> Optional[GuardConfig]:
+    """解析 hallucinationGuard 参数："true" / "false"，或 JSON 对象覆盖部分阈值；返回 None 表示关闭"""
+    if value is None or value == "":
+        return GuardConfig() if GUARD_DEFAULT else None
+    if isinstance(value, bool):
+        return GuardConfig() if value else None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lower() in ("true", "false"):
+            return GuardConfig() if value.lower() == "true" else None
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"hallucinationGuard 不是合法的 JSON: {e}") from e
+    if not isinstance(value, dict):
+        raise ValueError("hallucinationGuard 必须是 true / false 或 JSON 对象")
+    unknown = set(value) - set(GUARD_FIELDS) - {"enabled"}
+    if unknown:
+        raise ValueError(f"不支持的 hallucinationGuard 参数: {sorted(unknown)}，支持的参数有: {list(GUARD_FIELDS)}")
+    for key, item in value.items():
+        if key == "noSpeechThreshold":
+            valid = item is None or (isinstance(item, (int, float)) and not isinstance(item, bool) and 0 <= item <= 1)
+            expected = "介于 0 和 1 之间的数值或 null"
+        else:
+            valid = key == "enabled" or (isinstance(item, int) and not isinstance(item, bool) and item > 0)
+            expected = "正整数"
+        if not valid:
+            raise ValueError(f"hallucinationGuard 参数 {key} 必须是{expected}，收到: {item!r}")
+    if value.get("enabled") is False:
+        return None
+    return GuardConfig(**{GUARD_FIELDS[key]: item for key, item in value.items() if key in GUARD_FIELDS})
+
+
+# 当前线程正在执行的转写所使用的截断配置
+guard_state = threading.local()
+
+
+class GuardStats:
+    """截断次数和估算节省的解码时间；只有截断后的结果不再触发温度回退时才计入节省"""
+
+    def __init__(self):
+        self.windows = 0
+        self.repetition_cuts = 0
+        self.no_speech_cuts = 0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, repetition: int, no_speech: int, tokens_saved: int, seconds_saved: float):
+        with self._lock:
+            self.windows += 1
+            self.repetition_cuts += repetition
+            self.no_speech_cuts += no_speech
+            self.tokens_saved += tokens_saved
+            self.seconds_saved += seconds_saved
+
+    def take(self) -> Tuple[int, int, int, int, float]:
+        """取出并清零计数，多进程推理时由工作进程交回 HTTP 进程汇总"""
+        with self._lock:
+            counts = (self.windows, self.repetition_cuts, self.no_speech_cuts, self.tokens_saved, self.seconds_saved)
+            self.windows = self.repetition_cuts = self.no_speech_cuts = self.tokens_saved = 0
+            self.seconds_saved = 0.0
+            return counts
+
+    def add(self, counts: Tuple[int, int, int, int, float]):
+        with self._lock:
+            self.windows += counts[0]
+            self.repetition_cuts += counts[1]
+            self.no_speech_cuts += counts[2]
+            self.tokens_saved += counts[3]
+            self.seconds_saved += counts[4]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabledByDefault": GUARD_DEFAULT,
+                "decodes": self.windows,
+                "repetitionCuts": self.repetition_cuts,
+                "noSpeechCuts": self.no_speech_cuts,
+                "tokensSaved": self.tokens_saved,
+                "estimatedSecondsSaved": round(self.seconds_saved, 3)
+            }
+
+
+guard_stats = GuardStats()
+
+
+def repeated_ngram(tokens, config: GuardConfig) -> Tuple[int, int]:
+    """返回结尾连续重复的 (n-gram 长度, 重复次数)，不满足截断条件时返回 (0, 0)"""
+    for n in range(1, config.max_ngram + 1):
+        repeats = max(config.min_repeats, -(-config.min_span // n))
+        if len(tokens) < n * repeats:
+            break
+        tail = tokens[-n:]
+        count = 1
+        while len(tokens) >= n * (count + 1) and tokens[-n * (count + 1):len(tokens) - n * count] == tail:
+            count += 1
+        if count >= repeats:
+            return n, count
+    return 0, 0
+
+
+def repeated_tail(tokens, config: GuardConfig) -> bool:
+    """tokens 的结尾是否由同一个 n-gram 连续重复构成"""
+    return repeated_ngram(tokens, config)[0] > 0
+
+
+def trim_repeated_tail(tokens: List[int], config: GuardConfig) -> List[int]:
+    """把结尾连续重复的 n-gram 裁剪为只出现一次"""
+    n, count = repeated_ngram(tokens, config)
+    if count == 0:
+        return tokens
+    return tokens[:len(tokens) - n * (count - 1)]
+
+
+def needs_fallback(result) -> bool:
+    """与 whisper.transcribe() 的 decode_with_fallback 判断一致：结果是否会触发温度回退"""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        # 按静音跳过
+        return False
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+class HallucinationGuard:
+    """追加到 DecodingTask.logit_filters 末尾的过滤器，满足截断条件的序列强制输出 EOT"""
+
+    def __init__(self, task, config: GuardConfig):
+        from whisper.decoding import GreedyDecoder
+
+        self.task = task
+        self.config = config
+        self.steps = 0
+        self.repetition = False
+        self.no_speech = False
+        self.no_speech_probs = None
+        # 无语音检测需要逐行累计对数概率，束搜索每步会重排序列，只在贪心 / 采样解码时检测
+        self._silent_rows: List[int] = []
+        self._logprobs = None
+        self._sums: Dict[int, float] = {}
+        self._lengths: Dict[int, int] = {}
+
+        if config.no_speech_threshold is not None and task.tokenizer.no_speech is not None \
+                and isinstance(task.decoder, GreedyDecoder):
+            # 第一次前向时拿到 SOT 位置的无语音概率，与 DecodingTask._main_loop 的计算一致
+            original_logits = task.inference.logits
+
+            def logits(tokens, audio_features):
+                output = original_logits(tokens, audio_features)
+                if self.no_speech_probs is None:
+                    probs = output[:, task.sot_index].float().softmax(dim=-1)
+                    self.no_speech_probs = probs[:, task.tokenizer.no_speech].tolist()
+                return output
+
+            task.inference.logits = logits
+
+    @staticmethod
+    def force(logits, row: int, token: int):
+        logits[row, :] = -float("inf")
+        logits[row, token] = 0
+
+    def apply(self, logits, tokens):
+        self.steps += 1
+        tokenizer = self.task.tokenizer
+
+        if self.steps == 1 and self.no_speech_probs is not None:
+            # 阈值低于 whisper 的 0.6 时，截断的窗口不会被跳过，反而会触发回退
+            threshold = max(self.config.no_speech_threshold, NO_SPEECH_THRESHOLD)
+            self._silent_rows = [row for row, prob in enumerate(self.no_speech_probs) if prob > threshold]
+            self._sums = {row: 0.0 for row in self._silent_rows}
+            self._lengths = {row: 0 for row in self._silent_rows}
+
+        for row in self._silent_rows:
+            # 与 GreedyDecoder.update 一样累计上一步采样 token 的对数概率，结束后的 EOT 填充不计入
+            sampled = tokens[row, self.task.sample_begin:].tolist()
+            if not sampled or (len(sampled) > 1 and sampled[-2] == tokenizer.eot):
+                continue
+            self._sums[row] += self._logprobs[row, sampled[-1]].item()
+            if sampled[-1] == tokenizer.eot:
+                continue
+            self._lengths[row] += 1
+            # 强制的 EOT 对数概率为 0，结束后的平均对数概率就是 whisper 计算的 sum / (len + 1)
+            if self._lengths[row] >= NO_SPEECH_MIN_TOKENS \
+                    and self._sums[row] / (self._lengths[row] + 1) < LOGPROB_THRESHOLD:
+                self.no_speech = True
+                self.force(logits, row, tokenizer.eot)
+
+        # 束搜索每步都会重排序列，因此逐步独立判断，已结束的序列不再处理
+        for row in range(tokens.shape[0]):
+            sampled = tokens[row, self.task.sample_begin:].tolist()
+            if sampled and sampled[-1] == tokenizer.eot:
+                continue
+            if repeated_tail([t for t in sampled if t < tokenizer.timestamp_begin], self.config):
+                self.repetition = True
+                self.force(logits, row, tokenizer.eot)
+
+        if self._silent_rows:
+            self._logprobs = logits.float().log_softmax(dim=-1)
+
+    def trim(self, result):
+        """把结果末尾的重复部分裁剪为一次，并重新计算文本和压缩比，避免 whisper 因压缩比过高回退重解"""
+        from whisper.utils import compression_ratio
+
+        tokenizer = self.task.tokenizer
+        positions = [i for i, token in enumerate(result.tokens) if token < tokenizer.timestamp_begin]
+        text_tokens = [result.tokens[i] for i in positions]
+        kept = trim_repeated_tail(text_tokens, self.config)
+        if len(kept) == len(text_tokens):
+            return result
+        tokens = result.tokens[:positions[len(kept) - 1] + 1]
+        text = tokenizer.decode(tokens).strip()
+        return replace(result, tokens=tokens, text=text, compression_ratio=compression_ratio(text))
+
+    def finish(self, elapsed: float, results):
+        """解码结束后记录统计：提前结束且结果不再回退时，按本次每步耗时估算剩余步数节省的时间"""
+        tokens_saved = 0
+        if (self.repetition or self.no_speech) and self.steps < self.task.sample_len \
+                and not any(needs_fallback(result) for result in results):
+            tokens_saved = self.task.sample_len - self.steps
+        seconds_saved = tokens_saved * elapsed / self.steps if self.steps else 0.0
+        guard_stats.record(int(self.repetition), int(self.no_speech), tokens_saved, seconds_saved)
+
+
+def install_decode_hooks(model, model_name: str):
+    """替换模型实例的 decode 方法，逻辑与 whisper.decoding.decode 相同，只是编码器输出走缓存，并按需加上截断过滤器"""
+    # 模型已加载，torch / whisper 此时已导入，这里再导入没有额外开销
+    import torch
+    from whisper.decoding import DecodingOptions, DecodingTask
+
+    @torch.no_grad()
+    def decode(mel, options: DecodingOptions = DecodingOptions(), **kwargs):
+        # 每个窗口（及每次温度回退）解码前检查请求是否已被取消
+        cancel = getattr(cancel_state, "token", None)
+        if cancel is not None:
+            cancel.check()
+
+        single = mel.ndim == 2
+        if single:
+            mel = mel.unsqueeze(0)
+        if kwargs:
+            options = replace(options, **kwargs)
+
+        audio_features = encode_with_cache(model, model_name, mel, options.fp16)
+        task = DecodingTask(model, options)
+        config = getattr(guard_state, "config", None)
+        if config is None:
+            result = task.run(audio_features)
+        else:
+            guard = HallucinationGuard(task, config)
+            task.logit_filters.append(guard)
+            start_time = time.time()
+            result = [guard.trim(item) for item in task.run(audio_features)]
+            guard.finish(time.time() - start_time, result)
+        return result[0] if single else result
+
+    model.decode = decode
+    return model
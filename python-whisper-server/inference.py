@@ -0,0 +1,224 @@
+"""推理核心：WAV 解码、whisper 延迟导入、模型加载和单次 model.transcribe()
+
+HTTP 服务（main.py）、批量转写（bulk_transcribe.py）和多进程推理的工作进程（workers.py）共用这里的代码；
+本模块不创建 FastAPI 应用、调度器或进程池，工作进程导入它不会再初始化一遍服务端状态。
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from cancellation import CancelToken, cancel_state
+from decoding import guard_state, install_decode_hooks, install_mel_hook
+from progress import install_progress_hook, progress_state
+
+# torch / whisper / scipy 等重量级依赖延迟导入，这里记录各自的导入耗时（秒）
+import_timings: Dict[str, float] = {}
+import_lock = threading.RLock()
+
+def timed_import(module_name: str):
+    """导入模块并记录耗时，已导入的模块直接返回"""
+    with import_lock:
+        if module_name not in sys.modules:
+            start_time = time.time()
+            importlib.import_module(module_name)
+            import_timings[module_name] = round(time.time() - start_time, 3)
+            print(f"📦 导入 {module_name} 耗时: {import_timings[module_name]:.2f}s")
+        return sys.modules[module_name]
+
+# 只读取 WAV 文件头得到音频时长（秒），转写前的限流检查不需要解码整个文件
+def audio_duration(file: str) -> float:
+    import wave
+    
+    ext = os.path.splitext(file)[1].lower()
+    if ext != '.wav':
+        raise RuntimeError(f"Only WAV format is supported, got {ext}")
+    try:
+        with wave.open(file, 'rb') as wf:
+            return wf.getnframes() / wf.getframerate()
+    except wave.Error as e:
+        raise RuntimeError(f"Failed to load WAV audio: {e}") from e
+
+# 重写 Whisper 的 load_audio 函数，使用纯 Python 处理 WAV 文件
+def custom_load_audio(file: str, sr: int = 16000):
+    """使用纯 Python 处理 WAV 文件，避免依赖外部 FFmpeg 命令"""
+    print(f"🔧 使用自定义 load_audio 函数处理文件: {file}")
+    
+    try:
+        # 检查文件扩展名
+        ext = os.path.splitext(file)[1].lower()
+        
+        if ext == '.wav':
+            print(f"📦 直接处理 WAV 文件")
+            
+            # 使用 wave 模块直接读取 WAV 文件
+            import wave
+            
+            with wave.open(file, 'rb') as wf:
+                # 获取音频信息
+                channels = wf.getnchannels()
+                sample_width = wf.getsampwidth()
+                original_sr = wf.getframerate()
+                n_frames = wf.getnframes()
+                
+                print(f"   WAV 信息: 声道={channels}, 位深={sample_width*8}bit, 采样率={original_sr}, 帧数={n_frames}")
+                
+                # 读取音频数据
+                data = wf.readframes(n_frames)
+                
+                # 转换为 numpy 数组
+                if sample_width == 2:
+                    # 16位 PCM
+                    audio = np.frombuffer(data, np.int16)
+                elif sample_width == 4:
+                    # 32位 PCM
+                    audio = np.frombuffer(data, np.int32)
+                else:
+                    # 8位 PCM
+                    audio = np.frombuffer(data, np.uint8)
+                    audio = audio.astype(np.float32) - 128  # 转换为 [-1, 1] 范围
+                
+                # 转换为单声道
+                if channels > 1:
+                    print(f"   转换为单声道")
+                    audio = audio.reshape(-1, channels).mean(axis=1)
+                
+                # 归一化到 [-1, 1] 范围
+                if sample_width == 2:
+                    audio = audio.astype(np.float32) / 32768.0
+                elif sample_width == 4:
+                    audio = audio.astype(np.float32) / 2147483648.0
+                
+                # 重采样（如果需要）
+                if original_sr != sr:
+                    print(f"   重采样: {original_sr}Hz → {sr}Hz")
+                    # 使用简单的线性插值重采样
+                    signal = timed_import("scipy.signal")
+                    audio = signal.resample(audio, int(len(audio) * sr / original_sr))
+                
+                print(f"✅ WAV 处理成功，样本数量: {len(audio)}")
+                return audio
+        else:
+            # 对于其他格式，使用 wave 模块抛出明确的错误
+            print(f"❌ 仅支持 WAV 格式，不支持 {ext} 格式")
+            raise RuntimeError(f"Only WAV format is supported, got {ext}")
+    except wave.Error as e:
+        print(f"❌ WAV 文件处理失败: {e}")
+        raise RuntimeError(f"Failed to load WAV audio: {e}") from e
+    except Exception as e:
+        print(f"❌ 音频处理异常: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+# 词级时间戳对齐耗时，按线程统计
+alignment_timer = threading.local()
+
+# whisper 模块，首次使用时由 get_whisper() 导入
+whisper = None
+
+def get_whisper():
+    """导入 whisper（连带 torch）并打补丁，只在第一次调用时执行"""
+    global whisper
+    with import_lock:
+        if whisper is None:
+            timed_import("torch")
+            module = timed_import("whisper")
+            
+            # 替换 Whisper 库的默认 load_audio 函数
+            module.audio.load_audio = custom_load_audio
+            print("✅ 已替换 Whisper 的 load_audio 函数，使用纯 Python 处理 WAV 音频")
+            
+            # 包装 Whisper 的词级时间戳对齐函数，统计对齐耗时
+            # 注意 whisper.transcribe 在包里被同名函数覆盖，需要通过 importlib 取到模块本身
+            transcribe_module = importlib.import_module("whisper.transcribe")
+            original_add_word_timestamps = transcribe_module.add_word_timestamps
+            
+            def timed_add_word_timestamps(*args, **kwargs):
+                start_time = time.time()
+                try:
+                    return original_add_word_timestamps(*args, **kwargs)
+                finally:
+                    alignment_timer.seconds = getattr(alignment_timer, "seconds", 0.0) + time.time() - start_time
+            
+            transcribe_module.add_word_timestamps = timed_add_word_timestamps
+            
+            # 替换进度条，每个窗口解码完成后可以把新增片段推送给客户端
+            install_progress_hook(transcribe_module)
+            
+            # 多任务请求复用整段音频的 log-mel 频谱
+            install_mel_hook(transcribe_module)
+            whisper = module
+    return whisper
+
+# 模型缓存，避免重复加载
+model_cache = {}
+
+# 每个模型一把锁：Whisper 解码时会在模型上挂 kv-cache hook，同一个模型不能并发推理
+model_locks: Dict[str, threading.Lock] = {}
+model_locks_guard = threading.Lock()
+
+# 加载模型的辅助函数
+def load_model(model_name: str):
+    """加载模型，如果已在缓存中则直接返回"""
+    if model_name in model_cache:
+        print(f"📦 从缓存加载模型: {model_name}")
+        return model_cache[model_name]
+    
+    print(f"📥 正在加载模型: {model_name}")
+    start_time = time.time()
+    
+    # 加载模型，自动使用GPU（如果可用）
+    model = get_whisper().load_model(model_name)
+    
+    # 编码器输出走缓存，同一段音频的多次解码不再重复编码
+    install_decode_hooks(model, model_name)
+    
+    load_time = time.time() - start_time
+    print(f"✅ 模型加载完成，耗时: {load_time:.2f}s")
+    
+    # 存入缓存
+    model_cache[model_name] = model
+    return model
+
+# 获取模型对应的推理锁
+def get_model_lock(model_name: str) -> threading.Lock:
+    with model_locks_guard:
+        if model_name not in model_locks:
+            model_locks[model_name] = threading.Lock()
+        return model_locks[model_name]
+
+# 加载模型并执行一次 model.transcribe()，返回 (结果, 推理耗时)
+# 调用方负责加锁；多进程推理时在工作进程中调用
+def run_transcribe(model_name: str, audio: np.ndarray, transcribe_options: Dict[str, Any],
+                   guard=None, on_window: Optional[Callable] = None, cancel: Optional[CancelToken] = None):
+    model = load_model(model_name)
+    alignment_timer.seconds = 0.0
+    
+    if cancel is not None:
+        # 记录已解码的进度，取消时据此统计未解码的音频时长
+        def track_progress(segments, processed):
+            cancel.processed_seconds = processed
+            if on_window is not None:
+                on_window(segments, processed)
+        progress_state.callback = track_progress
+    else:
+        progress_state.callback = on_window
+    guard_state.config = guard
+    cancel_state.token = cancel
+    inference_start = time.time()
+    try:
+        result = model.transcribe(audio, **transcribe_options)
+    finally:
+        progress_state.callback = None
+        guard_state.config = None
+        cancel_state.token = None
+    inference_time = time.time() - inference_start
+    
+    if transcribe_options["word_timestamps"]:
+        result["alignment_time"] = alignment_timer.seconds
+    return result, inference_time
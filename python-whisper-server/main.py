@@ -1,90 +1,41 @@
-from fastapi import FastAPI, UploadFile, File, Form, Body
+import time
+
+# 进程启动时间，用于统计启动耗时（包含下面各依赖的导入）
+boot_time = time.time()
+
+from fastapi import FastAPI, UploadFile, File, Form, Body, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 import uvicorn
-import whisper
+import asyncio
+import contextlib
+import functools
+import hashlib
 import os
-import time
-from typing import List, Dict, Any, Optional
+import threading
+from typing import Callable, List, Dict, Any, Optional
 import tempfile
 import numpy as np
-import ffmpeg
-
-# 重写 Whisper 的 load_audio 函数，使用纯 Python 处理 WAV 文件
-def custom_load_audio(file: str, sr: int = 16000):
-    """使用纯 Python 处理 WAV 文件，避免依赖外部 FFmpeg 命令"""
-    print(f"🔧 使用自定义 load_audio 函数处理文件: {file}")
-    
-    try:
-        # 检查文件扩展名
-        ext = os.path.splitext(file)[1].lower()
-        
-        if ext == '.wav':
-            print(f"📦 直接处理 WAV 文件")
-            
-            # 使用 wave 模块直接读取 WAV 文件
-            import wave
-            
-            with wave.open(file, 'rb') as wf:
-                # 获取音频信息
-                channels = wf.getnchannels()
-                sample_width = wf.getsampwidth()
-                original_sr = wf.getframerate()
-                n_frames = wf.getnframes()
-                
-                print(f"   WAV 信息: 声道={channels}, 位深={sample_width*8}bit, 采样率={original_sr}, 帧数={n_frames}")
-                
-                # 读取音频数据
-                data = wf.readframes(n_frames)
-                
-                # 转换为 numpy 数组
-                if sample_width == 2:
-                    # 16位 PCM
-                    audio = np.frombuffer(data, np.int16)
-                elif sample_width == 4:
-                    # 32位 PCM
-                    audio = np.frombuffer(data, np.int32)
-                else:
-                    # 8位 PCM
-                    audio = np.frombuffer(data, np.uint8)
-                    audio = audio.astype(np.float32) - 128  # 转换为 [-1, 1] 范围
-                
-                # 转换为单声道
-                if channels > 1:
-                    print(f"   转换为单声道")
-                    audio = audio.reshape(-1, channels).mean(axis=1)
-                
-                # 归一化到 [-1, 1] 范围
-                if sample_width == 2:
-                    audio = audio.astype(np.float32) / 32768.0
-                elif sample_width == 4:
-                    audio = audio.astype(np.float32) / 2147483648.0
-                
-                # 重采样（如果需要）
-                if original_sr != sr:
-                    print(f"   重采样: {original_sr}Hz → {sr}Hz")
-                    # 使用简单的线性插值重采样
-                    from scipy import signal
-                    audio = signal.resample(audio, int(len(audio) * sr / original_sr))
-                
-                print(f"✅ WAV 处理成功，样本数量: {len(audio)}")
-                return audio
-        else:
-            # 对于其他格式，使用 wave 模块抛出明确的错误
-            print(f"❌ 仅支持 WAV 格式，不支持 {ext} 格式")
-            raise RuntimeError(f"Only WAV format is supported, got {ext}")
-    except wave.Error as e:
-        print(f"❌ WAV 文件处理失败: {e}")
-        raise RuntimeError(f"Failed to load WAV audio: {e}") from e
-    except Exception as e:
-        print(f"❌ 音频处理异常: {e}")
-        import traceback
-        traceback.print_exc()
-        raise
-
-# 替换 Whisper 库的默认 load_audio 函数
-whisper.audio.load_audio = custom_load_audio
-print("✅ 已替换 Whisper 的 load_audio 函数，使用纯 Python 处理 WAV 音频")
+from bulk_transcribe import BulkJob
+from streaming import StreamingWavDecoder, WindowedTranscriber
+from serializers import project, render_response, validate_format
+from coalescing import InflightCoalescer, coalesce_key, file_sha256
+from decoding import encoder_cache, guard_stats, mel_stats, parse_guard
+from cancellation import (
+    CANCEL_POLL_SECONDS, REASON_DEADLINE, REASON_DISCONNECTED, CancelToken, InferenceCancelled,
+    cancellation_stats
+)
+from scheduler import RateLimitExceeded, run_inference
+from progress import PROGRESS_MODES, format_event, progress_enabled, validate_progress
+from inference import (
+    audio_duration, custom_load_audio, get_model_lock, get_whisper, import_timings, load_model, model_cache
+)
+from transcription import (
+    PRELOAD_MODELS, SUPPORTED_MODELS, inference_pool, loaded_models, model_router, parse_tasks, request_cost,
+    scheduler, transcribe_audio, transcribe_bulk
+)
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -102,17 +53,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 模型缓存，避免重复加载
-model_cache = {}
+# 后台批量转写任务
+bulk_jobs: Dict[str, BulkJob] = {}
 
-# 支持的模型列表
-SUPPORTED_MODELS = [
-    "tiny",
-    "base",
-    "small",
-    "medium",
-    "large"
-]
+# 批量转写结果只能写入该目录，避免通过 HTTP 接口覆盖服务器上的任意文件
+BULK_OUTPUT_DIR = os.path.realpath(os.environ.get("WHISPER_BULK_OUTPUT_DIR", "bulk_results"))
+
+# 相同音频 + 相同选项的并发请求合并为一次推理
+coalescer = InflightCoalescer()
+
+# 后台预加载状态，/ready 据此判断是否就绪
+preload_state: Dict[str, Any] = {
+    "status": "pending",
+    "models": [],
+    "error": None,
+    "elapsed": None
+}
 
 # 支持的语言列表
 SUPPORTED_LANGUAGES = [
@@ -120,63 +76,147 @@ SUPPORTED_LANGUAGES = [
     "nl", "pl", "tr", "ar", "hi", "id", "ms", "th", "vi", "fil"
 ]
 
-# 加载模型的辅助函数
-def load_model(model_name: str):
-    """加载模型，如果已在缓存中则直接返回"""
-    if model_name in model_cache:
-        print(f"📦 从缓存加载模型: {model_name}")
-        return model_cache[model_name]
-    
-    print(f"📥 正在加载模型: {model_name}")
+# 后台预加载：导入 torch / whisper 并加载 WHISPER_PRELOAD_MODELS 中的模型，不阻塞 HTTP 服务启动
+def preload():
     start_time = time.time()
-    
-    # 加载模型，自动使用GPU（如果可用）
-    model = whisper.load_model(model_name)
-    
-    load_time = time.time() - start_time
-    print(f"✅ 模型加载完成，耗时: {load_time:.2f}s")
-    
-    # 存入缓存
-    model_cache[model_name] = model
-    return model
+    preload_state["status"] = "running"
+    try:
+        if inference_pool is not None:
+            # 模型在各工作进程中加载，HTTP 进程不需要导入 torch / whisper
+            inference_pool.start()
+            preload_state["models"].extend(PRELOAD_MODELS)
+        else:
+            get_whisper()
+            for model_name in PRELOAD_MODELS:
+                with get_model_lock(model_name):
+                    load_model(model_name)
+                preload_state["models"].append(model_name)
+        preload_state["status"] = "ready"
+        print(f"✅ 后台预加载完成，耗时: {time.time() - start_time:.2f}s")
+    except Exception as e:
+        print(f"❌ 后台预加载失败: {e}")
+        preload_state["status"] = "failed"
+        preload_state["error"] = str(e)
+    finally:
+        preload_state["elapsed"] = int((time.time() - start_time) * 1000)
 
-# 音频转文本核心函数
-def transcribe_audio(file_path: str, options: Dict[str, Any]):
-    """音频转文本核心处理"""
-    start_time = time.time()
-    
-    # 处理模型名称
-    model_name = options.get("model", "tiny")
-    
-    # 如果是完整模型名称（如 Xenova/whisper-tiny），提取简写
-    if "/" in model_name:
-        model_name = model_name.split("-")[-1]
-    
-    # 确保模型名称有效
-    if model_name not in SUPPORTED_MODELS:
-        raise ValueError(f"不支持的模型: {model_name}，支持的模型有: {SUPPORTED_MODELS}")
-    
-    # 加载模型
-    model = load_model(model_name)
-    
-    # 设置转录选项
-    transcribe_options = {
-        "language": options.get("language", "zh"),
-        "task": options.get("subtask", "transcribe"),
-        "verbose": False
-    }
+# 识别请求方：优先使用 X-API-Key，否则使用客户端 IP
+def get_client_id(request: Request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return f"key:{api_key}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+# 超出限额时返回 429
+def rate_limit_response(e: RateLimitExceeded):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(max(1, int(e.retry_after + 0.999)))},
+        content={
+            "success": False,
+            "error": str(e),
+            "retryAfter": round(e.retry_after, 1)
+        }
+    )
+
+# 等待转写结果，期间监视客户端断开和 timeoutMs 截止时间
+# 触发时设置取消标记并停止等待，推理线程在下一个窗口前停止
+async def await_cancellable(request: Request, awaitable, cancel: CancelToken, watch_disconnect: bool = True):
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=CANCEL_POLL_SECONDS)
+        if done:
+            return task.result()
+        if watch_disconnect and await request.is_disconnected():
+            cancel.cancel(REASON_DISCONNECTED)
+        reason = cancel.cancelled_reason()
+        if reason is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, InferenceCancelled):
+                pass
+            raise InferenceCancelled(reason, cancel.processed_seconds)
+
+# 推理被取消：超过 timeoutMs 返回 504，客户端已断开时返回 499（客户端通常已收不到）
+def cancelled_response(e: InferenceCancelled):
+    print(f"🛑 请求已取消: {str(e)}")
+    return JSONResponse(
+        status_code=504 if e.reason == REASON_DEADLINE else 499,
+        content={
+            "success": False,
+            "error": str(e),
+            "reason": e.reason
+        }
+    )
+
+# 逐窗口推送进度（SSE / NDJSON），最后一条消息携带与普通响应相同的完整 data
+def progress_response(request: Request, mode: str, audio: np.ndarray, options: Dict[str, Any], client_id: str,
+                      fields: Optional[str], build_response: Callable, cancel: CancelToken) -> StreamingResponse:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
     
-    print(f"🎤 正在转录音频，使用模型: {model_name}")
-    print(f"🌍 语言: {transcribe_options['language']}")
-    print(f"📋 任务: {transcribe_options['task']}")
+    def on_progress(payload: Dict[str, Any]):
+        if fields:
+            # 片段按 fields 中 chunks 的规则裁剪；未选中 chunks 时不推送片段内容
+            payload["segments"] = project({"chunks": payload["segments"]}, fields).get("chunks")
+        loop.call_soon_threadsafe(queue.put_nowait, ("progress", payload))
     
-    # 执行转录
-    result = model.transcribe(file_path, **transcribe_options)
+    async def run():
+        try:
+            # 客户端断开由 StreamingResponse 关闭 events() 时处理，这里只检查截止时间
+            result, processing_time = await await_cancellable(
+                request, run_inference(transcribe_audio, audio, options, client_id, on_progress, cancel),
+                cancel, watch_disconnect=False
+            )
+            response = build_response(result, processing_time)
+            if fields:
+                response["data"] = project(response["data"], fields)
+            print(f"✅ 转录完成，耗时: {processing_time:.2f}s")
+            queue.put_nowait(("result", response))
+        except InferenceCancelled as e:
+            print(f"🛑 请求已取消: {str(e)}")
+            queue.put_nowait(("error", {"success": False, "status": 504 if e.reason == REASON_DEADLINE else 499,
+                                        "error": str(e), "reason": e.reason}))
+        except Exception as e:
+            print(f"❌ 转录错误: {str(e)}")
+            queue.put_nowait(("error", {"success": False, "status": 500, "error": str(e)}))
+        finally:
+            queue.put_nowait(None)
     
-    processing_time = time.time() - start_time
-    print(f"✅ 转录完成，耗时: {processing_time:.2f}s")
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield format_event(mode, *item)
+        finally:
+            # 客户端中途断开时生成器被关闭，通知推理停止
+            if not task.done():
+                cancel.cancel(REASON_DISCONNECTED)
+        await task
     
-    return result, processing_time
+    return StreamingResponse(
+        events(),
+        media_type=PROGRESS_MODES[mode],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 响应中报告实际使用的模型：model=auto 时为路由选中的模型
+def used_model(result: Dict[str, Any], requested: str) -> str:
+    return result["routing"]["model"] if "routing" in result else requested
+
+# 输出格式不可用时的错误响应
+def format_error_response(error: str):
+    return JSONResponse(
+        status_code=400,
+        content={
+            "success": False,
+            "error": error
+        }
+    )
 
 # 处理音频文件，Whisper模型会自动处理格式，所以简化处理
 def process_audio_file(file_path: str) -> str:
@@ -193,26 +233,55 @@ async def health_check():
         "status": "healthy",
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "uptime": time.time() - app.startup_time if hasattr(app, 'startup_time') else 0,
-        "version": "2.0.0"
+        "version": "2.0.0",
+        "ready": preload_state["status"] == "ready"
     }
 
+# 就绪检查接口：后台预加载完成前返回 503
+@app.get("/ready")
+async def readiness_check():
+    content = {
+        "success": preload_state["status"] == "ready",
+        "status": preload_state["status"],
+        "bootTime": int((app.startup_time - boot_time) * 1000) if hasattr(app, 'startup_time') else None,
+        "preload": dict(preload_state),
+        "importTimings": dict(import_timings),
+        "loadedModels": loaded_models()
+    }
+    return JSONResponse(status_code=200 if content["success"] else 503, content=content)
+
+# 应用关闭时停止工作进程并回收共享内存
+@app.on_event("shutdown")
+async def shutdown_event():
+    if inference_pool is not None:
+        inference_pool.shutdown()
+
 # 应用启动事件
 @app.on_event("startup")
 async def startup_event():
     app.startup_time = time.time()
-    print("🚀 Whisper Python 服务器启动成功!")
+    
+    # torch / whisper 导入和模型加载放到后台线程，HTTP 服务立即可用
+    threading.Thread(target=preload, name="preload", daemon=True).start()
+    
+    print(f"🚀 Whisper Python 服务器启动成功! 启动耗时: {(app.startup_time - boot_time) * 1000:.0f}ms")
     print("=" * 50)
     print(f"📍 服务器地址: http://localhost:3000")
     print(f"🔗 健康检查: http://localhost:3000/health")
+    print(f"🔗 就绪检查: http://localhost:3000/ready")
     print(f"📋 API 文档: http://localhost:3000/docs")
     print("=" * 50)
     print("\n📡 可用的 API 端点:")
     print("  GET  /health                    - 健康检查")
+    print("  GET  /ready                     - 就绪检查（模型预加载完成后返回 200）")
     print("  GET  /api/models                - 获取支持的模型列表")
     print("  GET  /api/languages             - 获取支持的语言列表")
+    print("  GET  /api/stats                 - 获取运行统计")
     print("  POST /api/transcribe            - 单个音频转文本")
+    print("  POST /api/transcribe-stream     - 流式上传音频转文本（原始 WAV 请求体）")
     print("  POST /api/batch-transcribe      - 批量音频转文本")
     print("  POST /api/transcribe-file       - 本地文件转文本")
+    print("  POST /api/bulk-transcribe       - 批量转写本地归档（后台任务）")
     print("  POST /api/cleanup               - 清理模型资源")
     print("\n💡 使用示例:")
     print("  curl -X POST http://localhost:3000/api/transcribe \\")
@@ -267,17 +336,40 @@ async def get_languages():
             }
         )
 
+# 获取运行统计
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "success": True,
+        "data": {
+            "coalescing": dict(coalescer.stats),
+            "routing": model_router.snapshot(),
+            # 多进程推理时编码器缓存在各工作进程中，这里是工作进程上报的汇总
+            "encoderCache": inference_pool.encoder_cache_stats() if inference_pool is not None else encoder_cache.stats(),
+            "melSpectrogram": dict(mel_stats),
+            "scheduler": scheduler.snapshot(),
+            "hallucinationGuard": guard_stats.stats(),
+            "inferencePool": inference_pool.stats() if inference_pool is not None else None,
+            "cancellation": cancellation_stats.stats()
+        }
+    }
+
 # 清理模型资源
 @app.post("/api/cleanup")
 async def cleanup_models():
     try:
         # 清空模型缓存
-        global model_cache
         model_cache.clear()
-        print("🗑️  模型资源已清理")
+        encoder_cache.clear()
+        message = "模型资源已清理"
+        if inference_pool is not None:
+            # 模型和编码器缓存都在工作进程中，回收进程才能真正释放
+            inference_pool.recycle()
+            message = "模型资源已清理，推理工作进程已回收，下次请求时重新启动"
+        print(f"🗑️  {message}")
         return {
             "success": True,
-            "message": "模型资源已清理"
+            "message": message
         }
     except Exception as e:
         return JSONResponse(
@@ -291,17 +383,37 @@ async def cleanup_models():
 # 单个音频文件转文本
 @app.post("/api/transcribe")
 async def transcribe(
+    request: Request,
     audio: UploadFile = File(...),
     model: str = Form("tiny"),
     language: str = Form("zh"),
     quantized: str = Form("false"),
-    subtask: str = Form("transcribe")
+    subtask: str = Form("transcribe"),
+    wordTimestamps: str = Form("false"),
+    tasks: Optional[str] = Form(None),
+    fields: Optional[str] = Form(None),
+    format: str = Form("json"),
+    progress: str = Form("false"),
+    hallucinationGuard: Optional[str] = Form(None),
+    timeoutMs: Optional[int] = Form(None)
 ):
     temp_files = []  # 用于跟踪临时文件，确保清理
     
     try:
         print("\n🎤 接收到音频转文本请求")
         
+        # 先检查输出格式，避免转写完成后才报错
+        format_error = validate_format(format) or validate_progress(progress)
+        if format_error:
+            return format_error_response(format_error)
+        if progress_enabled(progress) and format.lower() != "json":
+            return format_error_response("进度推送只支持 json 格式")
+        try:
+            parsed_tasks = parse_tasks(tasks, language)
+            parse_guard(hallucinationGuard)
+        except ValueError as e:
+            return format_error_response(str(e))
+        
         # 保存上传的文件到临时位置
         print(f"📁 使用临时目录: {tempfile.gettempdir()}")
         
@@ -320,6 +432,7 @@ async def transcribe(
             content = await audio.read()
             f.write(content)
             print(f"💾 写入内容大小: {len(content) / 1024 / 1024:.2f} MB")
+        content_hash = hashlib.sha256(content).hexdigest()
         
         # 验证文件是否成功创建
         if not os.path.exists(input_path):
@@ -339,37 +452,70 @@ async def transcribe(
             "model": model,
             "language": language,
             "quantized": quantized.lower() == "true",
-            "subtask": subtask
+            "subtask": subtask,
+            "wordTimestamps": wordTimestamps.lower() == "true",
+            "tasks": parsed_tasks,
+            "hallucinationGuard": hallucinationGuard
+        }
+        file_info = {
+            "originalName": audio.filename,
+            "size": os.path.getsize(input_path),
+            "mimetype": audio.content_type
         }
-        
-        # 执行转录
-        result, processing_time = transcribe_audio(processed_path, options)
         
         # 构建响应，处理可能不存在的duration键
-        response = {
-            "success": True,
-            "data": {
-                "text": result["text"],
-                "chunks": result["segments"],
-                "language": result["language"],
-                "duration": result.get("duration", 0),  # 使用get方法避免KeyError
-                "task": subtask,
-                "model": model,
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-                "processingTime": int(processing_time * 1000),
-                "fileInfo": {
-                    "originalName": audio.filename,
-                    "size": os.path.getsize(input_path),
-                    "mimetype": audio.content_type
+        def build_response(result: Dict[str, Any], processing_time: float) -> Dict[str, Any]:
+            return {
+                "success": True,
+                "data": {
+                    "text": result["text"],
+                    "chunks": result["segments"],
+                    "language": result["language"],
+                    "duration": result.get("duration", 0),  # 使用get方法避免KeyError
+                    "task": options["tasks"][0]["subtask"] if options["tasks"] else subtask,
+                    "model": used_model(result, model),
+                    "routing": result.get("routing"),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "processingTime": int(processing_time * 1000),
+                    "alignmentTime": int(result["alignment_time"] * 1000) if "alignment_time" in result else None,
+                    "tasks": result.get("tasks"),
+                    "fileInfo": file_info
                 }
             }
-        }
+        
+        client_id = get_client_id(request)
+        
+        if progress_enabled(progress):
+            # 先解码音频，临时文件照常在返回前清理，转写在响应流中进行
+            audio_data = await run_in_threadpool(custom_load_audio, processed_path)
+            # 按音频时长扣减客户端令牌，超出限额直接返回 429
+            scheduler.admit(client_id, request_cost(len(audio_data) / 16000, options))
+            return progress_response(
+                request, progress.lower(), audio_data, options, client_id, fields, build_response,
+                CancelToken(timeoutMs)
+            )
+        
+        # 按音频时长扣减客户端令牌；合并到其他客户端的推理上时同样计入本客户端的用量
+        scheduler.admit(client_id, request_cost(audio_duration(processed_path), options))
+        
+        # 执行转录，相同内容的请求正在推理时直接合并；客户端断开或超时后停止
+        cancel = CancelToken(timeoutMs)
+        result, processing_time = await await_cancellable(request, coalescer.run(
+            coalesce_key(content_hash, options), transcribe_audio, processed_path, options, client_id,
+            cancel=cancel
+        ), cancel)
+        response = build_response(result, processing_time)
         
         print(f"✅ 转录完成，耗时: {processing_time:.2f}s")
         print(f"📝 识别结果: {result['text'][:100]}{'...' if len(result['text']) > 100 else ''}")
         
-        return response
+        return render_response(response, format, fields, request.headers.get("accept-encoding"))
         
+    except RateLimitExceeded as e:
+        print(f"🚦 请求被限流: {str(e)}")
+        return rate_limit_response(e)
+    except InferenceCancelled as e:
+        return cancelled_response(e)
     except Exception as e:
         print(f"❌ 转录错误: {str(e)}")
         import traceback
@@ -392,18 +538,197 @@ async def transcribe(
             except Exception as cleanup_error:
                 print(f"⚠️  清理临时文件失败: {cleanup_error}")
 
+# 流式上传转文本：请求体为原始 WAV 字节，边接收边解码，缓冲满 30 秒即开始转写
+@app.post("/api/transcribe-stream")
+async def transcribe_stream(
+    request: Request,
+    model: str = "tiny",
+    language: str = "zh",
+    quantized: str = "false",
+    subtask: str = "transcribe",
+    filename: str = "stream.wav",
+    wordTimestamps: str = "false",
+    fields: Optional[str] = None,
+    format: str = "json",
+    hallucinationGuard: Optional[str] = None,
+    timeoutMs: Optional[int] = None
+):
+    start_time = time.time()
+    consumer = None
+    cancel = CancelToken(timeoutMs)
+    
+    try:
+        print("\n🎤 接收到流式音频转文本请求")
+        
+        # 先检查输出格式，避免转写完成后才报错
+        format_error = validate_format(format)
+        if format_error:
+            return format_error_response(format_error)
+        try:
+            parse_guard(hallucinationGuard)
+        except ValueError as e:
+            return format_error_response(str(e))
+        
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/"):
+            return JSONResponse(
+                status_code=415,
+                content={
+                    "success": False,
+                    "error": "流式接口的请求体应为原始 WAV 数据，表单上传请使用 /api/transcribe"
+                }
+            )
+        
+        print(f"🎯 使用模型: {model}")
+        print(f"🌍 语言设置: {language}")
+        
+        # 设置转录选项
+        options = {
+            "model": model,
+            "language": language,
+            "quantized": quantized.lower() == "true",
+            "subtask": subtask,
+            "wordTimestamps": wordTimestamps.lower() == "true",
+            "hallucinationGuard": hallucinationGuard
+        }
+        
+        routing = None
+        client_id = get_client_id(request)
+        
+        # model=auto 时由第一个窗口选定模型，后续窗口沿用，保证整段结果来自同一个模型
+        def transcribe_window(window, prompt):
+            nonlocal routing
+            # 每个窗口按时长扣减客户端令牌
+            scheduler.admit(client_id, len(window) / 16000)
+            result = transcribe_audio(window, {**options, "initial_prompt": prompt}, client_id, cancel=cancel)[0]
+            if "routing" in result:
+                routing = result["routing"]
+                options["model"] = routing["model"]
+            return result
+        
+        decoder = StreamingWavDecoder()
+        windowed = WindowedTranscriber(transcribe_window)
+        data_ready = asyncio.Event()
+        upload_done = False
+        first_window_at = None
+        
+        # 转写协程：缓冲满一个窗口就在推理线程池中转写，上传仍在继续
+        async def consume():
+            nonlocal first_window_at
+            while True:
+                if windowed.has_full_window() or (upload_done and windowed.has_pending()):
+                    if first_window_at is None:
+                        first_window_at = time.time()
+                        print(f"⚡ 首个窗口开始转写，已接收 {decoder.bytes_received / 1024 / 1024:.2f} MB")
+                    await run_inference(windowed.step, upload_done)
+                    continue
+                if upload_done:
+                    return
+                await data_ready.wait()
+                data_ready.clear()
+        
+        consumer = asyncio.create_task(consume())
+        
+        try:
+            async for chunk in request.stream():
+                windowed.append(decoder.feed(chunk))
+                data_ready.set()
+                if consumer.done():
+                    # 转写出错，不再继续接收
+                    break
+            if not consumer.done():
+                windowed.append(decoder.finish())
+        finally:
+            upload_done = True
+            data_ready.set()
+        
+        print(f"💾 上传接收完成: {decoder.bytes_received / 1024 / 1024:.2f} MB")
+        await await_cancellable(request, consumer, cancel)
+        
+        result = windowed.result()
+        processing_time = time.time() - start_time
+        
+        # 构建响应，结构与 /api/transcribe 一致
+        response = {
+            "success": True,
+            "data": {
+                "text": result["text"],
+                "chunks": result["segments"],
+                "language": result["language"],
+                "duration": windowed.total_samples / 16000,
+                "task": subtask,
+                "model": options["model"],
+                "routing": routing,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "processingTime": int(processing_time * 1000),
+                "alignmentTime": int(result["alignment_time"] * 1000) if options["wordTimestamps"] else None,
+                "fileInfo": {
+                    "originalName": filename,
+                    "size": decoder.bytes_received,
+                    "mimetype": content_type
+                },
+                "streaming": {
+                    "windows": windowed.windows,
+                    "firstWindowAt": int((first_window_at - start_time) * 1000) if first_window_at else None
+                }
+            }
+        }
+        
+        print(f"✅ 流式转录完成，耗时: {processing_time:.2f}s，窗口数: {windowed.windows}")
+        
+        return render_response(response, format, fields, request.headers.get("accept-encoding"))
+        
+    except RateLimitExceeded as e:
+        print(f"🚦 请求被限流: {str(e)}")
+        return rate_limit_response(e)
+    except InferenceCancelled as e:
+        return cancelled_response(e)
+    except Exception as e:
+        if isinstance(e, ClientDisconnect):
+            # 上传中途断开，正在转写的窗口结束后不再继续
+            cancel.cancel(REASON_DISCONNECTED)
+        if consumer is not None and not consumer.done():
+            consumer.cancel()
+        print(f"❌ 流式转录错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse(
+            status_code=500,
+            content={
+                "success": False,
+                "error": str(e),
+                "details": traceback.format_exc()
+            }
+        )
+
 # 批量音频转文本
 @app.post("/api/batch-transcribe")
 async def batch_transcribe(
+    request: Request,
     audio: List[UploadFile] = File(...),
     model: str = Form("tiny"),
     language: str = Form("zh"),
     quantized: str = Form("false"),
-    subtask: str = Form("transcribe")
+    subtask: str = Form("transcribe"),
+    fields: Optional[str] = Form(None),
+    format: str = Form("json"),
+    hallucinationGuard: Optional[str] = Form(None),
+    timeoutMs: Optional[int] = Form(None)
 ):
+    temp_files = []  # 用于跟踪临时文件，确保清理
+    
     try:
         print(f"\n📂 接收到批量转文本请求，共 {len(audio)} 个文件")
         
+        # 批量结果没有 chunks，只支持 json / msgpack
+        format_error = validate_format(format, has_segments=False)
+        if format_error:
+            return format_error_response(format_error)
+        try:
+            parse_guard(hallucinationGuard)
+        except ValueError as e:
+            return format_error_response(str(e))
+        
         if not audio:
             return JSONResponse(
                 status_code=400,
@@ -421,31 +746,50 @@ async def batch_transcribe(
             "model": model,
             "language": language,
             "quantized": quantized.lower() == "true",
-            "subtask": subtask
+            "subtask": subtask,
+            "hallucinationGuard": hallucinationGuard
         }
         
         results = []
         total_processing_time = 0
         start_time = time.time()
+        # 整个批次共用一个取消标记：客户端断开或超过 timeoutMs 后，排队和未开始的文件都不再推理
+        cancel = CancelToken(timeoutMs)
+        client_id = get_client_id(request)
+        
+        # 先保存全部上传文件，按总时长检查一次限额：超出时整批返回 429，而不是逐个文件失败
+        uploads = []
+        batch_seconds = 0.0
+        for file in audio:
+            temp_input = tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename)[1], delete=False)
+            input_path = temp_input.name
+            temp_input.close()
+            temp_files.append(input_path)
+            
+            # 写入文件内容
+            content = await file.read()
+            with open(input_path, "wb") as f:
+                f.write(content)
+            uploads.append((input_path, hashlib.sha256(content).hexdigest()))
+            
+            # 无法读取的文件不计入时长，转写时记为失败
+            with contextlib.suppress(RuntimeError):
+                batch_seconds += audio_duration(input_path)
+        scheduler.admit(client_id, request_cost(batch_seconds, options))
         
-        for i, file in enumerate(audio):
+        for i, (file, (input_path, content_hash)) in enumerate(zip(audio, uploads)):
             print(f"\n--- 处理文件 {i+1}/{len(audio)}: {file.filename} ---")
             
             try:
-                # 保存上传的文件到临时位置
-                temp_input = tempfile.NamedTemporaryFile(suffix=os.path.splitext(file.filename)[1], delete=False)
-                input_path = temp_input.name
-                temp_input.close()
-                
-                # 写入文件内容
-                with open(input_path, "wb") as f:
-                    f.write(await file.read())
-                
                 # 处理音频文件
                 processed_path = process_audio_file(input_path)
+                temp_files.append(processed_path)
                 
-                # 执行转录
-                result, processing_time = transcribe_audio(processed_path, options)
+                # 执行转录，相同内容的请求正在推理时直接合并
+                result, processing_time = await await_cancellable(request, coalescer.run(
+                    coalesce_key(content_hash, options), transcribe_audio, processed_path, options, client_id,
+                    cancel=cancel
+                ), cancel)
                 
                 # 记录结果，处理可能不存在的duration键
                 results.append({
@@ -456,18 +800,18 @@ async def batch_transcribe(
                     "duration": result.get("duration", 0),  # 使用get方法避免KeyError
                     "confidence": sum(seg.get("confidence", 0) for seg in result["segments"]) / len(result["segments"]) if result["segments"] else 0,
                     "language": result["language"],
+                    "model": used_model(result, model),
+                    "routing": result.get("routing"),
                     "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
                     "processingTime": int(processing_time * 1000)
                 })
                 
                 total_processing_time += processing_time
                 
-                # 清理临时文件
-                os.unlink(input_path)
-                os.unlink(processed_path)
-                
                 print(f"✅ 文件 {i+1} 处理成功")
                 
+            except InferenceCancelled:
+                raise
             except Exception as e:
                 print(f"❌ 文件 {i+1} 处理失败: {str(e)}")
                 results.append({
@@ -505,8 +849,13 @@ async def batch_transcribe(
         print(f"\n✅ 批量转录完成，总耗时: {total_time:.2f}s")
         print(f"📊 成功: {response['data']['summary']['successful']}, 失败: {response['data']['summary']['failed']}")
         
-        return response
+        return render_response(response, format, fields, request.headers.get("accept-encoding"))
         
+    except RateLimitExceeded as e:
+        print(f"🚦 请求被限流: {str(e)}")
+        return rate_limit_response(e)
+    except InferenceCancelled as e:
+        return cancelled_response(e)
     except Exception as e:
         print(f"❌ 批量转录错误: {str(e)}")
         return JSONResponse(
@@ -517,16 +866,35 @@ async def batch_transcribe(
                 "details": str(e)
             }
         )
+    finally:
+        # 清理临时文件；process_audio_file 直接返回原路径，两者相同时只删除一次
+        for file_path in set(temp_files):
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(file_path)
 
 # 本地文件转文本
 @app.post("/api/transcribe-file")
 async def transcribe_file(
+    request: Request,
     filePath: str = Body(...),
-    options: Dict[str, Any] = Body(default_factory=dict)
+    options: Dict[str, Any] = Body(default_factory=dict),
+    fields: Optional[str] = Body(None),
+    format: str = Body("json"),
+    timeoutMs: Optional[int] = Body(None)
 ):
     try:
         print(f"\n📁 处理本地文件: {filePath}")
         
+        # 先检查输出格式，避免转写完成后才报错
+        format_error = validate_format(format)
+        if format_error:
+            return format_error_response(format_error)
+        try:
+            parsed_tasks = parse_tasks(options.get("tasks"), options.get("language", "zh"))
+            parse_guard(options.get("hallucinationGuard"))
+        except ValueError as e:
+            return format_error_response(str(e))
+        
         if not filePath:
             return JSONResponse(
                 status_code=400,
@@ -562,13 +930,24 @@ async def transcribe_file(
         }
         
         # 合并选项
-        merged_options = {**default_options, **options}
+        merged_options = {**default_options, **options, "tasks": parsed_tasks}
         
-        # 执行转录
-        result, processing_time = transcribe_audio(processed_path, merged_options)
+        # 按音频时长扣减客户端令牌，超出限额直接返回 429
+        client_id = get_client_id(request)
+        scheduler.admit(client_id, request_cost(audio_duration(processed_path), merged_options))
         
-        # 清理临时文件
-        os.unlink(processed_path)
+        # 执行转录，相同内容的请求正在推理时直接合并
+        content_hash = await run_in_threadpool(file_sha256, processed_path)
+        cancel = CancelToken(timeoutMs)
+        result, processing_time = await await_cancellable(request, coalescer.run(
+            coalesce_key(content_hash, merged_options), transcribe_audio, processed_path, merged_options,
+            client_id, cancel=cancel
+        ), cancel)
+        
+        # 只清理处理过程中生成的临时文件，调用方的原始文件不能删除（合并的请求指向同一个文件）
+        if processed_path != filePath:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(processed_path)
         
         # 构建响应，处理可能不存在的duration键
         response = {
@@ -578,10 +957,13 @@ async def transcribe_file(
                 "chunks": result["segments"],
                 "language": result["language"],
                 "duration": result.get("duration", 0),  # 使用get方法避免KeyError
-                "task": merged_options["subtask"],
-                "model": merged_options["model"],
+                "task": merged_options["tasks"][0]["subtask"] if merged_options["tasks"] else merged_options["subtask"],
+                "model": used_model(result, merged_options["model"]),
+                "routing": result.get("routing"),
                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
                 "processingTime": int(processing_time * 1000),
+                "alignmentTime": int(result["alignment_time"] * 1000) if "alignment_time" in result else None,
+                "tasks": result.get("tasks"),
                 "filePath": filePath
             }
         }
@@ -589,8 +971,13 @@ async def transcribe_file(
         print(f"✅ 本地文件转录完成，耗时: {processing_time:.2f}s")
         print(f"📝 识别结果: {result['text'][:100]}{'...' if len(result['text']) > 100 else ''}")
         
-        return response
+        return render_response(response, format, fields, request.headers.get("accept-encoding"))
         
+    except RateLimitExceeded as e:
+        print(f"🚦 请求被限流: {str(e)}")
+        return rate_limit_response(e)
+    except InferenceCancelled as e:
+        return cancelled_response(e)
     except Exception as e:
         print(f"❌ 本地文件转录错误: {str(e)}")
         return JSONResponse(
@@ -602,6 +989,125 @@ async def transcribe_file(
             }
         )
 
+# 批量转写本地归档（目录 glob 或 JSONL 清单），后台运行
+@app.post("/api/bulk-transcribe")
+async def bulk_transcribe(
+    request: Request,
+    source: str = Body(...),
+    output: str = Body(...),
+    options: Dict[str, Any] = Body(default_factory=dict),
+    workers: int = Body(2),
+    resume: bool = Body(True)
+):
+    try:
+        print(f"\n📂 接收到批量归档转写请求: {source}")
+        
+        if not source or not output:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": "请提供 source（目录、glob 或 JSONL 清单）和 output（.jsonl 或 .parquet）"
+                }
+            )
+        
+        try:
+            parse_tasks(options.get("tasks"), options.get("language", "zh"))
+            parse_guard(options.get("hallucinationGuard"))
+        except ValueError as e:
+            return format_error_response(str(e))
+        
+        # output 为结果目录下的相对路径，解析后不能跳出结果目录
+        output = os.path.realpath(os.path.join(BULK_OUTPUT_DIR, output))
+        if os.path.commonpath([output, BULK_OUTPUT_DIR]) != BULK_OUTPUT_DIR or \
+                not output.endswith((".jsonl", ".parquet")):
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": f"output 必须是结果目录 {BULK_OUTPUT_DIR} 下的 .jsonl 或 .parquet 文件"
+                }
+            )
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        
+        # 同一个输出文件只能有一个任务在写
+        for job in bulk_jobs.values():
+            if job.active and job.output == output:
+                return JSONResponse(
+                    status_code=409,
+                    content={
+                        "success": False,
+                        "error": f"输出文件正在被任务 {job.id} 使用",
+                        "data": job.to_dict()
+                    }
+                )
+        
+        # 设置默认选项
+        default_options = {
+            "model": "tiny",
+            "language": "zh",
+            "subtask": "transcribe"
+        }
+        
+        job = BulkJob(source, output, {**default_options, **options}, workers, resume)
+        bulk_jobs[job.id] = job
+        # 后台任务超出限额时等待令牌补足，不会把后面的文件都记为失败
+        job.start(
+            functools.partial(transcribe_bulk, client_id=get_client_id(request), stop_event=job.stop_event),
+            custom_load_audio
+        )
+        
+        return {
+            "success": True,
+            "data": job.to_dict()
+        }
+        
+    except Exception as e:
+        print(f"❌ 批量归档转写错误: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={
+                "success": False,
+                "error": str(e),
+                "details": str(e)
+            }
+        )
+
+# 查询批量转写任务状态
+@app.get("/api/bulk-transcribe/{job_id}")
+async def get_bulk_job(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "success": False,
+                "error": f"任务不存在: {job_id}"
+            }
+        )
+    return {
+        "success": True,
+        "data": job.to_dict()
+    }
+
+# 停止批量转写任务，已写入的结果保留，可再次提交续跑
+@app.post("/api/bulk-transcribe/{job_id}/stop")
+async def stop_bulk_job(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "success": False,
+                "error": f"任务不存在: {job_id}"
+            }
+        )
+    job.stop_event.set()
+    return {
+        "success": True,
+        "data": job.to_dict()
+    }
+
 # 404 处理
 @app.api_route("{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def not_found(path: str):
@@ -612,11 +1118,17 @@ async def not_found(path: str):
             "error": "接口不存在",
             "availableEndpoints": [
                 "GET /health",
+                "GET /ready",
                 "GET /api/models",
                 "GET /api/languages",
+                "GET /api/stats",
                 "POST /api/transcribe",
+                "POST /api/transcribe-stream",
                 "POST /api/batch-transcribe",
                 "POST /api/transcribe-file",
+                "POST /api/bulk-transcribe",
+                "GET /api/bulk-transcribe/{jobId}",
+                "POST /api/bulk-transcribe/{jobId}/stop",
                 "POST /api/cleanup"
             ]
         }
@@ -628,5 +1140,6 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=3000,
-        reload=True  # 开发模式下启用自动重载
+        # 开发时可设置 WHISPER_RELOAD=true 启用自动重载
+        reload=os.environ.get("WHISPER_RELOAD", "false").lower() == "true"
     )
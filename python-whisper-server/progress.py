@@ -0,0 +1,117 @@
+"""逐窗口进度推送：每个 30 秒窗口解码完成后立即把新增片段发给客户端
+
+whisper.transcribe() 每解码完一个窗口都会调用一次 tqdm 进度条的 update()，
+此时该窗口的片段已经追加到 all_segments 中，之后不会再被修改。
+这里替换 whisper.transcribe 模块里的 tqdm，在 update() 时取出新增片段交给当前线程的回调。
+依赖 transcribe() 的局部变量名，requirements.txt 固定了 openai-whisper 版本；
+升级后变量名对不上时安装钩子直接报错，而不是静默推送空片段。
+"""
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from serializers import dumps_json
+
+# 支持的推送方式：Server-Sent Events 或每行一个 JSON
+PROGRESS_MODES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson"
+}
+
+# 每秒 mel 帧数（16kHz，hop 160），进度条以帧为单位
+FRAMES_PER_SECOND = 100
+
+# transcribe() 中保存已解码片段的局部变量
+SEGMENTS_LOCAL = "all_segments"
+
+# 当前线程的进度回调：callback(新增片段, 已处理秒数)
+progress_state = threading.local()
+
+
+def validate_progress(mode: Optional[str]) -> Optional[str]:
+    """返回错误信息，合法时返回 None；"false" 或空表示不推送进度"""
+    mode = (mode or "false").lower()
+    if mode == "false" or mode in PROGRESS_MODES:
+        return None
+    return f"不支持的进度推送方式: {mode}，支持的方式有: {list(PROGRESS_MODES)}"
+
+
+def progress_enabled(mode: Optional[str]) -> bool:
+    return (mode or "false").lower() in PROGRESS_MODES
+
+
+class ProgressBar:
+    """替代 tqdm.tqdm：有回调时推送进度，否则退回原始进度条"""
+
+    def __init__(self, original, total: int = None, **kwargs):
+        self.total = total
+        self.n = 0
+        self._emitted = 0
+        self._callback: Optional[Callable] = getattr(progress_state, "callback", None)
+        self._bar = original(total=total, **kwargs) if self._callback is None else None
+
+    def __enter__(self):
+        if self._bar is not None:
+            self._bar.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        if self._bar is not None:
+            return self._bar.__exit__(*exc)
+        return False
+
+    def update(self, n: int = 1):
+        self.n += n
+        if self._bar is not None:
+            return self._bar.update(n)
+        # 调用方是 whisper.transcribe() 的主循环，all_segments 是它的局部变量
+        caller = sys._getframe(1)
+        if SEGMENTS_LOCAL not in caller.f_locals:
+            raise RuntimeError(
+                f"进度推送需要 whisper.transcribe() 的局部变量 {SEGMENTS_LOCAL}，"
+                f"调用方 {caller.f_code.co_name} 中没有，请检查 openai-whisper 版本"
+            )
+        segments = caller.f_locals[SEGMENTS_LOCAL]
+        new_segments = segments[self._emitted:]
+        self._emitted = len(segments)
+        self._callback(new_segments, self.n / FRAMES_PER_SECOND)
+
+
+class TqdmProxy:
+    """放到 whisper.transcribe 模块的 tqdm 名字上，只替换 tqdm.tqdm"""
+
+    def __init__(self, module):
+        self._module = module
+
+    def tqdm(self, *args, **kwargs):
+        return ProgressBar(self._module.tqdm, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._module, name)
+
+
+def install_progress_hook(transcribe_module):
+    if SEGMENTS_LOCAL not in transcribe_module.transcribe.__code__.co_varnames:
+        raise RuntimeError(
+            f"whisper.transcribe() 中没有局部变量 {SEGMENTS_LOCAL}，无法逐窗口推送进度，请检查 openai-whisper 版本"
+        )
+    if not isinstance(transcribe_module.tqdm, TqdmProxy):
+        transcribe_module.tqdm = TqdmProxy(transcribe_module.tqdm)
+
+
+def format_event(mode: str, event: str, payload: Dict[str, Any]) -> bytes:
+    """按推送方式编码一条消息"""
+    if mode == "sse":
+        return b"event: " + event.encode("utf-8") + b"\ndata: " + dumps_json(payload) + b"\n\n"
+    return dumps_json({"event": event, **payload}) + b"\n"
+
+
+def progress_payload(task: str, segments: List[Dict[str, Any]], processed: float, total: float) -> Dict[str, Any]:
+    processed = min(processed, total)
+    return {
+        "task": task,
+        "processedSeconds": round(processed, 2),
+        "totalSeconds": round(total, 2),
+        "progress": round(processed / total, 4) if total else 1.0,
+        "segments": segments
+    }
@@ -0,0 +1,104 @@
+"""model=auto 自适应模型路由：按音频时长、当前排队量和延迟目标，在已加载的模型中选择"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# 从小到大排列，压力大时向小模型回退
+MODEL_ORDER = ["tiny", "base", "small", "medium", "large"]
+
+# 各模型的初始实时率（处理耗时 / 音频时长），有实测数据后用指数滑动平均替换
+DEFAULT_RTF = {
+    "tiny": 0.05,
+    "base": 0.1,
+    "small": 0.3,
+    "medium": 0.8,
+    "large": 1.5
+}
+
+# 延迟目标（毫秒），可通过环境变量配置
+LATENCY_TARGET_MS = int(os.environ.get("WHISPER_LATENCY_TARGET_MS", "10000"))
+
+# 没有任何已加载模型时使用的模型
+FALLBACK_MODEL = os.environ.get("WHISPER_AUTO_FALLBACK_MODEL", "tiny")
+
+# 实时率滑动平均的权重
+RTF_ALPHA = 0.3
+
+
+class ModelRouter:
+    """记录各模型的实测速度和排队中的音频时长，为 model=auto 的请求选择模型"""
+
+    def __init__(self, latency_target_ms: int = LATENCY_TARGET_MS, fallback_model: str = FALLBACK_MODEL):
+        self.latency_target_ms = latency_target_ms
+        self.fallback_model = fallback_model
+        self.rtf: Dict[str, float] = dict(DEFAULT_RTF)
+        self.measured: Dict[str, int] = {name: 0 for name in MODEL_ORDER}
+        self.pending_seconds: Dict[str, float] = {name: 0.0 for name in MODEL_ORDER}
+        self.decisions: Dict[str, int] = {name: 0 for name in MODEL_ORDER}
+        self.downgrades = 0
+        self._lock = threading.Lock()
+
+    def begin(self, model_name: str, audio_seconds: float):
+        """请求开始排队/推理，计入该模型的待处理音频时长"""
+        with self._lock:
+            self.pending_seconds[model_name] = self.pending_seconds.get(model_name, 0.0) + audio_seconds
+
+    def end(self, model_name: str, audio_seconds: float, processing_seconds: Optional[float] = None):
+        """请求结束；推理成功时用本次耗时更新实时率"""
+        with self._lock:
+            self.pending_seconds[model_name] = max(0.0, self.pending_seconds.get(model_name, 0.0) - audio_seconds)
+            if processing_seconds is not None and audio_seconds > 0:
+                rtf = processing_seconds / audio_seconds
+                if self.measured.get(model_name):
+                    rtf = RTF_ALPHA * rtf + (1 - RTF_ALPHA) * self.rtf[model_name]
+                self.rtf[model_name] = rtf
+                self.measured[model_name] = self.measured.get(model_name, 0) + 1
+
+    def queue_delay(self) -> float:
+        """所有模型共用同一块计算资源，排队延迟按全部待处理音频估算（秒）"""
+        return sum(seconds * self.rtf.get(name, 1.0) for name, seconds in self.pending_seconds.items())
+
+    def choose(self, audio_seconds: float, resident_models: List[str]) -> Tuple[str, Dict[str, Any]]:
+        """选择模型，返回 (模型名, 路由说明)"""
+        with self._lock:
+            candidates = [name for name in MODEL_ORDER if name in resident_models]
+            queue_delay = self.queue_delay()
+
+            def predict_ms(name: str) -> int:
+                return int((queue_delay + audio_seconds * self.rtf[name]) * 1000)
+
+            if not candidates:
+                model_name = self.fallback_model
+                reason = f"没有已加载的模型，使用默认模型 {model_name}"
+            else:
+                fitting = [name for name in candidates if predict_ms(name) <= self.latency_target_ms]
+                if fitting:
+                    model_name = fitting[-1]
+                    reason = f"{model_name} 是预计延迟在目标 {self.latency_target_ms}ms 内的最大已加载模型"
+                else:
+                    model_name = candidates[0]
+                    self.downgrades += 1
+                    reason = f"所有已加载模型的预计延迟都超过目标 {self.latency_target_ms}ms，回退到最小模型 {model_name}"
+
+            self.decisions[model_name] = self.decisions.get(model_name, 0) + 1
+            return model_name, {
+                "requested": "auto",
+                "model": model_name,
+                "reason": reason,
+                "audioSeconds": round(audio_seconds, 2),
+                "queueDelayMs": int(queue_delay * 1000),
+                "predictedLatencyMs": predict_ms(model_name),
+                "latencyTargetMs": self.latency_target_ms,
+                "candidates": candidates
+            }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "latencyTargetMs": self.latency_target_ms,
+                "queueDelayMs": int(self.queue_delay() * 1000),
+                "pendingSeconds": {name: round(seconds, 2) for name, seconds in self.pending_seconds.items() if seconds},
+                "realtimeFactor": {name: round(rtf, 4) for name, rtf in self.rtf.items()},
+                "decisions": dict(self.decisions),
+                "downgrades": self.downgrades
+            }
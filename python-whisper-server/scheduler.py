@@ -0,0 +1,222 @@
+"""按客户端公平调度推理：以音频时长为成本的加权公平排队 + 令牌桶限流
+
+排队等待推理槽的线程会一直阻塞到轮到自己，因此 HTTP 接口把推理交给专用的 inference_executor，
+而不是 anyio 的默认线程池；后者还要处理音频解码、文件哈希等短任务，不能被排队中的推理占满。
+"""
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from cancellation import CANCEL_POLL_SECONDS
+
+# 同时进行的推理数量（通常为 1，所有模型共用同一块 GPU）
+INFERENCE_CONCURRENCY = int(os.environ.get("WHISPER_INFERENCE_CONCURRENCY", "1"))
+
+# 每个客户端的令牌桶：每秒补充的音频秒数（0 表示不限流）和桶容量
+CLIENT_RATE = float(os.environ.get("WHISPER_CLIENT_RATE", "0"))
+CLIENT_BURST = float(os.environ.get("WHISPER_CLIENT_BURST", "600"))
+
+# 推理专用线程数，即同时排队 + 推理的请求上限，超出的请求在线程池队列中按到达顺序等待
+INFERENCE_THREADS = int(os.environ.get("WHISPER_INFERENCE_THREADS", "32"))
+
+inference_executor = ThreadPoolExecutor(max_workers=max(1, INFERENCE_THREADS), thread_name_prefix="inference")
+
+
+async def run_inference(fn: Callable, *args, **kwargs) -> Any:
+    """在推理专用线程池中执行 fn，排队等待推理槽不会占用 anyio 的默认线程池"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_executor, functools.partial(fn, *args, **kwargs))
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """解析客户端权重配置，例如 "key-a=4,10.0.0.5=2"，未配置的客户端权重为 1"""
+    weights = {}
+    for item in value.split(","):
+        client, _, weight = item.strip().rpartition("=")
+        if client:
+            weights[client] = float(weight)
+    return weights
+
+
+CLIENT_WEIGHTS = parse_weights(os.environ.get("WHISPER_CLIENT_WEIGHTS", ""))
+
+
+class RateLimitExceeded(Exception):
+    """客户端超出令牌桶限额"""
+
+    def __init__(self, client_id: str, retry_after: float):
+        self.client_id = client_id
+        self.retry_after = retry_after
+        super().__init__(f"客户端请求的音频时长超出限额，请在 {retry_after:.1f}s 后重试")
+
+
+def mask_client_id(client_id: str) -> str:
+    """统计中不暴露完整的 API Key"""
+    if client_id.startswith("key:") and len(client_id) > 10:
+        return client_id[:8] + "***"
+    return client_id
+
+
+class ClientState:
+    def __init__(self, weight: float, burst: float):
+        self.weight = weight
+        self.tokens = burst
+        self.refilled_at = time.time()
+        self.last_finish = 0.0  # 该客户端最后一个任务的虚拟完成时间
+        self.queued = 0
+        self.active = 0
+        self.requests = 0
+        self.rejected = 0
+        self.throttle_seconds = 0.0  # 后台任务等待令牌补足的累计时间
+        self.audio_seconds = 0.0
+        self.processing_seconds = 0.0
+        self.wait_seconds = 0.0
+
+
+class FairScheduler:
+    """加权公平排队（WFQ）
+
+    每个任务按音频时长 / 客户端权重计算虚拟完成时间，推理槽空出时总是交给虚拟完成时间最小的任务。
+    提交大量音频的客户端虚拟时间增长得快，交互式的小请求可以插到它前面，不会被整批任务堵住。
+    """
+
+    def __init__(self, capacity: int = INFERENCE_CONCURRENCY, rate: float = CLIENT_RATE,
+                 burst: float = CLIENT_BURST, weights: Optional[Dict[str, float]] = None):
+        self.capacity = max(1, capacity)
+        self.rate = rate
+        self.burst = burst
+        self.weights = weights if weights is not None else CLIENT_WEIGHTS
+        self._cond = threading.Condition()
+        self._queue = []  # (虚拟完成时间, 序号)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._active = 0
+        self._clients: Dict[str, ClientState] = {}
+
+    def _client(self, client_id: str) -> ClientState:
+        client = self._clients.get(client_id)
+        if client is None:
+            client = ClientState(self.weights.get(client_id.split(":", 1)[-1], 1.0), self.burst)
+            self._clients[client_id] = client
+        return client
+
+    def _take(self, client: ClientState, cost: float) -> float:
+        """从令牌桶扣除 cost，令牌不足时不扣除并返回还需等待的秒数；桶满时允许单个超长请求透支"""
+        now = time.time()
+        client.tokens = min(self.burst, client.tokens + (now - client.refilled_at) * self.rate)
+        client.refilled_at = now
+        if client.tokens < min(cost, self.burst):
+            return (min(cost, self.burst) - client.tokens) / self.rate
+        client.tokens -= cost
+        return 0.0
+
+    def admit(self, client_id: str, cost: float):
+        """令牌桶检查，超出限额时抛出 RateLimitExceeded"""
+        if self.rate <= 0:
+            return
+        with self._cond:
+            client = self._client(client_id)
+            retry_after = self._take(client, cost)
+            if retry_after > 0:
+                client.rejected += 1
+                raise RateLimitExceeded(client_id, retry_after)
+
+    def wait_admit(self, client_id: str, cost: float, stop_event: Optional[threading.Event] = None) -> bool:
+        """后台批量任务使用：令牌不足时等待补足而不是拒绝；等待期间 stop_event 被设置时放弃并返回 False"""
+        if self.rate <= 0:
+            return True
+        started_at = time.time()
+        while True:
+            with self._cond:
+                client = self._client(client_id)
+                retry_after = self._take(client, cost)
+                if retry_after <= 0:
+                    client.throttle_seconds += time.time() - started_at
+                    return True
+            if stop_event is not None:
+                if stop_event.wait(retry_after):
+                    return False
+            else:
+                time.sleep(retry_after)
+
+    @contextmanager
+    def slot(self, client_id: str, cost: float, cancel=None):
+        """排队等待推理槽，cost 为音频秒数；传入 cancel 时排队期间也会响应取消"""
+        enqueued_at = time.time()
+        with self._cond:
+            client = self._client(client_id)
+            start_tag = max(self._virtual_time, client.last_finish)
+            finish_tag = start_tag + cost / client.weight
+            client.last_finish = finish_tag
+            ticket = (finish_tag, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            client.queued += 1
+            try:
+                while self._active >= self.capacity or self._queue[0] != ticket:
+                    if cancel is None:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait(CANCEL_POLL_SECONDS)
+                        cancel.check()
+            except BaseException:
+                # 等待期间被中断，撤回排队
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                client.queued -= 1
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, start_tag)
+            self._active += 1
+            client.queued -= 1
+            client.active += 1
+            client.requests += 1
+            client.audio_seconds += cost
+            client.wait_seconds += time.time() - enqueued_at
+            # 容量大于 1 时，下一个排队的任务可能也可以开始了
+            self._cond.notify_all()
+
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                client.active -= 1
+                client.processing_seconds += time.time() - started_at
+                self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "capacity": self.capacity,
+                "active": self._active,
+                "queued": len(self._queue),
+                "rateLimit": {"audioSecondsPerSecond": self.rate, "burst": self.burst} if self.rate > 0 else None,
+                "clients": {
+                    mask_client_id(client_id): {
+                        "weight": client.weight,
+                        "queued": client.queued,
+                        "active": client.active,
+                        "requests": client.requests,
+                        "rejected": client.rejected,
+                        "throttleSeconds": round(client.throttle_seconds, 2),
+                        "audioSeconds": round(client.audio_seconds, 2),
+                        "processingSeconds": round(client.processing_seconds, 2),
+                        "waitSeconds": round(client.wait_seconds, 2),
+                        "tokens": round(client.tokens, 2) if self.rate > 0 else None
+                    }
+                    for client_id, client in self._clients.items()
+                }
+            }
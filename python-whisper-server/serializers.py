@@ -0,0 +1,235 @@
+"""转写结果的统一序列化：字段投影、快速 JSON 编码、gzip 协商以及 SRT / VTT / MessagePack 输出"""
+import gzip
+import json
+from typing import Any, Dict, List, Optional
+
+from fastapi.responses import Response
+
+# orjson 和 msgpack 都是可选依赖，未安装时分别退回标准库 json / 不支持 msgpack 格式
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 支持的输出格式
+SUPPORTED_FORMATS = ["json", "msgpack", "srt", "vtt", "text"]
+
+# 只能由带 chunks 的单文件结果生成的格式
+SEGMENT_FORMATS = ["srt", "vtt", "text"]
+
+# 带词级时间戳时，SRT 按词边界切分字幕，每条字幕的最大字符数
+SUBTITLE_MAX_CHARS = 42
+
+# 小于该大小的响应不值得压缩
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+
+def validate_format(fmt: str, has_segments: bool = True) -> Optional[str]:
+    """检查输出格式是否可用，不可用时返回错误信息；在转写开始前调用，避免白跑一次推理"""
+    fmt = (fmt or "json").lower()
+    if fmt not in SUPPORTED_FORMATS:
+        return f"不支持的输出格式: {fmt}，支持的格式有: {SUPPORTED_FORMATS}"
+    if fmt in SEGMENT_FORMATS and not has_segments:
+        return f"该接口不支持 {fmt} 格式，可用格式: json, msgpack"
+    if fmt == "msgpack" and msgpack is None:
+        return "msgpack 格式需要安装 msgpack: pip install msgpack"
+    return None
+
+
+def _build_tree(paths: List[str]) -> Dict[str, Any]:
+    """把 "chunks.start" 这样的点分路径构造成嵌套字典，叶子为 True"""
+    tree: Dict[str, Any] = {}
+    for path in paths:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def parse_fields(fields: Optional[str]):
+    """解析 fields 参数，返回 (包含树, 排除树)
+
+    例如 "text,chunks.start,chunks.end,chunks.text" 只返回这些字段，
+    "-chunks.tokens,-chunks.avg_logprob" 返回除这些字段外的全部内容，两种写法可以混用。
+    """
+    if not fields:
+        return None, None
+    include, exclude = [], []
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        if field.startswith("-"):
+            exclude.append(field[1:])
+        else:
+            include.append(field)
+    return (_build_tree(include) if include else None), (_build_tree(exclude) if exclude else None)
+
+
+def _include(value: Any, tree: Dict[str, Any]) -> Any:
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    projected = {}
+    for key, sub in tree.items():
+        if key in value:
+            projected[key] = value[key] if sub is True else _include(value[key], sub)
+    return projected
+
+
+def _exclude(value: Any, tree: Dict[str, Any]) -> Any:
+    if isinstance(value, list):
+        return [_exclude(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    projected = {}
+    for key, item in value.items():
+        sub = tree.get(key)
+        if sub is True:
+            continue
+        projected[key] = item if sub is None else _exclude(item, sub)
+    return projected
+
+
+def project(data: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+    """按 fields 参数裁剪 data 对象"""
+    include, exclude = parse_fields(fields)
+    if include is not None:
+        data = _include(data, include)
+    if exclude is not None:
+        data = _exclude(data, exclude)
+    return data
+
+
+def dumps_json(payload: Any) -> bytes:
+    """紧凑 JSON 编码，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def format_timestamp(seconds: float, decimal_marker: str = ".") -> str:
+    """把秒数格式化为 HH:MM:SS.mmm（SRT 使用逗号作为小数点）"""
+    milliseconds = int(round(max(seconds, 0) * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{decimal_marker}{milliseconds:03d}"
+
+
+def _split_by_words(seg: Dict[str, Any], max_chars: int = SUBTITLE_MAX_CHARS) -> List[Dict[str, Any]]:
+    """按词级时间戳把一个片段切成不超过 max_chars 的若干条字幕，时间取自首尾词"""
+    cues, current = [], []
+    for word in seg["words"]:
+        if current and len("".join(w["word"] for w in current + [word]).strip()) > max_chars:
+            cues.append(current)
+            current = []
+        current.append(word)
+    if current:
+        cues.append(current)
+    return [
+        {"start": words[0]["start"], "end": words[-1]["end"], "text": "".join(w["word"] for w in words)}
+        for words in cues
+    ]
+
+
+def segments_to_srt(segments: List[Dict[str, Any]]) -> str:
+    cues = []
+    for seg in segments:
+        if not seg["text"].strip():
+            continue
+        cues.extend(_split_by_words(seg) if seg.get("words") else [seg])
+
+    lines = []
+    for index, cue in enumerate(cues):
+        lines.append(str(index + 1))
+        lines.append(f"{format_timestamp(cue['start'], ',')} --> {format_timestamp(cue['end'], ',')}")
+        lines.append(cue["text"].strip())
+        lines.append("")
+    return "\n".join(lines)
+
+
+def segments_to_vtt(segments: List[Dict[str, Any]]) -> str:
+    lines = ["WEBVTT", ""]
+    for seg in segments:
+        if not seg["text"].strip():
+            continue
+        lines.append(f"{format_timestamp(seg['start'])} --> {format_timestamp(seg['end'])}")
+        if seg.get("words"):
+            # 带词级时间戳时使用 WebVTT 的行内时间标记，播放器可以逐词高亮
+            text = seg["words"][0]["word"].lstrip() + "".join(
+                f"<{format_timestamp(w['start'])}>{w['word']}" for w in seg["words"][1:]
+            )
+            lines.append(text.strip())
+        else:
+            lines.append(seg["text"].strip())
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def render_response(
+    payload: Dict[str, Any],
+    fmt: str = "json",
+    fields: Optional[str] = None,
+    accept_encoding: Optional[str] = None,
+    status_code: int = 200
+) -> Response:
+    """三个转写接口共用的响应生成函数，payload 为 {"success": ..., "data": {...}}"""
+    fmt = (fmt or "json").lower()
+    data = payload.get("data") or {}
+
+    if fmt == "srt":
+        body = segments_to_srt(data.get("chunks") or []).encode("utf-8")
+        media_type = "application/x-subrip; charset=utf-8"
+    elif fmt == "vtt":
+        body = segments_to_vtt(data.get("chunks") or []).encode("utf-8")
+        media_type = "text/vtt; charset=utf-8"
+    elif fmt == "text":
+        body = (data.get("text") or "").strip().encode("utf-8")
+        media_type = "text/plain; charset=utf-8"
+    else:
+        if fields:
+            payload = {**payload, "data": project(data, fields)}
+        if fmt == "msgpack":
+            body = msgpack.packb(payload, use_bin_type=True, default=_msgpack_default)
+            media_type = "application/msgpack"
+        else:
+            body = dumps_json(payload)
+            media_type = "application/json"
+
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_SIZE and _accepts_gzip(accept_encoding):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def _msgpack_default(value: Any) -> Any:
+    # numpy 标量和数组转换为 Python 原生类型
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
@@ -0,0 +1,331 @@
+"""流式音频处理：边接收上传边解析 WAV、边按 30 秒窗口转写"""
+import importlib
+import math
+import struct
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Whisper 的采样率和单个窗口长度
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+
+# WAV 格式码
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# 作为 initial_prompt 传给下一个窗口的上文长度（字符数）
+PROMPT_CHARS = 200
+
+
+class StreamingResampler:
+    """分块多相 FIR 重采样，与 scipy.signal.resample_poly 使用同样的抗混叠低通滤波器
+
+    按 up/down 的有理比例重采样：每个输出样本由对应相位的滤波器系数与最近的若干输入样本做点积。
+    块与块之间保留滤波所需的历史输入，拼接处的结果与一次性重采样整段音频相同。
+    """
+
+    def __init__(self, source_sr: int, target_sr: int = SAMPLE_RATE):
+        ratio = math.gcd(source_sr, target_sr)
+        self.up = target_sr // ratio
+        self.down = source_sr // ratio
+        self._history = np.zeros(0, dtype=np.float32)
+        self._received = 0  # 已收到的输入样本数
+        self._emitted = 0  # 已输出的样本数
+        if self.up == self.down:
+            return
+
+        signal = importlib.import_module("scipy.signal")
+        # 与 resample_poly 的默认设计一致：Kaiser 窗，截止频率取两个采样率中较低的奈奎斯特频率
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        taps = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * self.up
+        self._delay = half_len
+        # 多相分解：第 p 个相位使用 taps[p::up]，补零到相同长度，按输入样本从新到旧排列
+        self._width = -(-len(taps) // self.up)
+        padded = np.zeros(self._width * self.up)
+        padded[:len(taps)] = taps
+        self._phases = padded.reshape(self._width, self.up).T.astype(np.float32)
+
+    def _emit(self, available: int) -> np.ndarray:
+        """输出所有只依赖前 available 个输入样本的样本"""
+        # 输出样本 m 对应上采样序列的位置 m * down + delay，需要的最新输入下标为其整除 up
+        last = (available * self.up - 1 - self._delay) // self.down
+        count = last + 1 - self._emitted
+        if count <= 0:
+            return np.zeros(0, dtype=np.float32)
+        positions = (self._emitted + np.arange(count)) * self.down + self._delay
+        newest = positions // self.up
+        # _history[0] 对应的输入下标；更早的输入视为 0
+        base = self._received - len(self._history)
+        index = newest[:, None] - np.arange(self._width)[None, :] - base
+        window = np.where(index >= 0, self._history[np.clip(index, 0, None)], 0.0)
+        out = np.einsum("ij,ij->i", window, self._phases[positions % self.up]).astype(np.float32)
+        self._emitted += count
+        return out
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        if self.up == self.down:
+            return block
+        self._history = np.concatenate([self._history, block.astype(np.float32)])
+        self._received += len(block)
+        out = self._emit(self._received)
+        # 只保留下一个输出样本仍会用到的输入
+        needed = (self._emitted * self.down + self._delay) // self.up - self._width + 1
+        drop = needed - (self._received - len(self._history))
+        if drop > 0:
+            self._history = self._history[drop:]
+        return out
+
+    def flush(self) -> np.ndarray:
+        """输入结束：之后的输入视为 0，补齐剩余样本，总长度为 ceil(输入样本数 * up / down)"""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        remaining = -(-self._received * self.up // self.down) - self._emitted
+        if remaining <= 0:
+            return np.zeros(0, dtype=np.float32)
+        # 最后一个输出样本需要的最新输入下标，不足的部分补 0
+        pad = ((self._emitted + remaining - 1) * self.down + self._delay) // self.up + 1 - self._received
+        self._history = np.concatenate([self._history, np.zeros(pad, dtype=np.float32)])
+        self._received += pad
+        return self._emit(self._received)[:remaining]
+
+
+class StreamingWavDecoder:
+    """增量解析 RIFF/WAV，把到达的 PCM 数据转换为 16kHz 单声道 float32 音频块"""
+
+    def __init__(self, sr: int = SAMPLE_RATE):
+        self.sr = sr
+        self.channels = None
+        self.sample_rate = None
+        self.sample_width = None
+        self.format_tag = None
+        self.bytes_received = 0
+        self._buffer = bytearray()
+        self._state = "riff"
+        self._chunk_left = 0
+        self._data_left = None
+        self._resampler = None
+
+    @property
+    def header_parsed(self) -> bool:
+        return self._state == "data"
+
+    def feed(self, data: bytes) -> np.ndarray:
+        """喂入一段原始字节，返回本次能解出的音频（可能为空）"""
+        self.bytes_received += len(data)
+        self._buffer.extend(data)
+
+        while self._state != "data":
+            if not self._parse_header_step():
+                return np.zeros(0, dtype=np.float32)
+
+        return self._decode_available()
+
+    def finish(self) -> np.ndarray:
+        """上传结束，输出剩余音频"""
+        if self._state != "data":
+            raise RuntimeError("Failed to load WAV audio: incomplete RIFF header")
+        return self._resampler.flush()
+
+    def _parse_header_step(self) -> bool:
+        """解析一个头部片段；数据不够时返回 False 等待更多字节"""
+        buf = self._buffer
+        if self._state == "riff":
+            if len(buf) < 12:
+                return False
+            if buf[0:4] != b"RIFF" or buf[8:12] != b"WAVE":
+                raise RuntimeError("Only WAV format is supported for streaming upload")
+            del buf[:12]
+            self._state = "chunk"
+            return True
+
+        if self._state == "skip":
+            skipped = min(self._chunk_left, len(buf))
+            del buf[:skipped]
+            self._chunk_left -= skipped
+            if self._chunk_left:
+                return False
+            self._state = "chunk"
+            return True
+
+        # 读取下一个子块头
+        if len(buf) < 8:
+            return False
+        chunk_id = bytes(buf[0:4])
+        chunk_size = struct.unpack("<I", buf[4:8])[0]
+
+        if chunk_id == b"fmt ":
+            if len(buf) < 8 + chunk_size:
+                return False
+            self.format_tag, self.channels, self.sample_rate, _, _, bits = struct.unpack("<HHIIHH", buf[8:24])
+            if self.format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # 扩展格式的真实格式码在 SubFormat GUID 的前两个字节
+                self.format_tag = struct.unpack("<H", buf[32:34])[0]
+            if self.format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise RuntimeError(f"Failed to load WAV audio: unsupported format tag {self.format_tag}")
+            self.sample_width = bits // 8
+            del buf[:8 + chunk_size + (chunk_size & 1)]
+            print(f"   WAV 信息: 声道={self.channels}, 位深={bits}bit, 采样率={self.sample_rate}")
+            return True
+
+        del buf[:8]
+        if chunk_id == b"data":
+            if self.channels is None:
+                raise RuntimeError("Failed to load WAV audio: data chunk before fmt chunk")
+            # 流式生成的 WAV 常把 data 长度写成 0 或 0xFFFFFFFF，此时一直读到请求结束
+            self._data_left = None if chunk_size in (0, 0xFFFFFFFF) else chunk_size
+            self._resampler = StreamingResampler(self.sample_rate, self.sr)
+            self._state = "data"
+            return True
+
+        # 其他子块（LIST 等）直接跳过，子块按偶数字节对齐
+        self._chunk_left = chunk_size + (chunk_size & 1)
+        self._state = "skip"
+        return True
+
+    def _decode_available(self) -> np.ndarray:
+        frame_size = self.sample_width * self.channels
+        available = len(self._buffer)
+        if self._data_left is not None:
+            available = min(available, self._data_left)
+        usable = available - available % frame_size
+        if usable <= 0:
+            return np.zeros(0, dtype=np.float32)
+
+        raw = bytes(self._buffer[:usable])
+        del self._buffer[:usable]
+        if self._data_left is not None:
+            self._data_left -= usable
+            if self._data_left == 0:
+                # data 块之后的内容（如尾部 LIST 块）不是音频
+                self._buffer.clear()
+
+        audio = self._to_float32(raw)
+        if self.channels > 1:
+            audio = audio.reshape(-1, self.channels).mean(axis=1)
+        return self._resampler.process(audio)
+
+    def _to_float32(self, raw: bytes) -> np.ndarray:
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            dtype = np.float32 if self.sample_width == 4 else np.float64
+            return np.frombuffer(raw, dtype).astype(np.float32)
+        if self.sample_width == 1:
+            return (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128.0
+        if self.sample_width == 2:
+            return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+        if self.sample_width == 3:
+            # 24 位 PCM：补一个低位字节后按 int32 解释
+            bytes3 = np.frombuffer(raw, np.uint8).reshape(-1, 3)
+            padded = np.zeros((len(bytes3), 4), dtype=np.uint8)
+            padded[:, 1:] = bytes3
+            return padded.view("<i4").reshape(-1).astype(np.float32) / 2147483648.0
+        if self.sample_width == 4:
+            return np.frombuffer(raw, np.int32).astype(np.float32) / 2147483648.0
+        raise RuntimeError(f"Failed to load WAV audio: unsupported sample width {self.sample_width}")
+
+
+class WindowedTranscriber:
+    """按 30 秒窗口增量转写不断增长的音频缓冲
+
+    每个窗口转写后丢弃最后一个（可能被截断的）片段，下一个窗口从它的起点开始，
+    并把已识别文本的末尾作为 initial_prompt 传下去，相当于 Whisper 自身的 seek 逻辑。
+    """
+
+    def __init__(self, transcribe_fn: Callable[[np.ndarray, Optional[str]], Dict[str, Any]],
+                 window_seconds: int = WINDOW_SECONDS, sr: int = SAMPLE_RATE):
+        self.transcribe_fn = transcribe_fn
+        self.sr = sr
+        self.window_samples = window_seconds * sr
+        self.segments: List[Dict[str, Any]] = []
+        self.language = None
+        self.windows = 0
+        self.alignment_time = 0.0
+        self._lock = threading.Lock()
+        self._blocks: List[np.ndarray] = []
+        self._buffered = 0
+        self._offset = 0  # 缓冲区起点在整段音频中的样本位置
+        self._total = 0
+
+    @property
+    def total_samples(self) -> int:
+        return self._total
+
+    @property
+    def offset_samples(self) -> int:
+        return self._offset
+
+    def append(self, block: np.ndarray):
+        if not len(block):
+            return
+        with self._lock:
+            self._blocks.append(block)
+            self._buffered += len(block)
+            self._total += len(block)
+
+    def has_full_window(self) -> bool:
+        return self._buffered >= self.window_samples
+
+    def has_pending(self) -> bool:
+        return self._buffered > 0
+
+    def step(self, final: bool = False) -> List[Dict[str, Any]]:
+        """转写缓冲区开头的一个窗口，返回新确认的片段"""
+        with self._lock:
+            buffer = np.concatenate(self._blocks) if len(self._blocks) != 1 else self._blocks[0]
+            self._blocks = [buffer]
+        take = min(len(buffer), self.window_samples)
+        window = buffer[:take]
+        # 只有缓冲区里的音频都在本窗口内时，才能确认最后一个片段
+        is_last = final and take == len(buffer)
+
+        prompt = "".join(seg["text"] for seg in self.segments)[-PROMPT_CHARS:] or None
+        result = self.transcribe_fn(window, prompt)
+        self.windows += 1
+        self.alignment_time += result.get("alignment_time", 0.0)
+        if self.language is None:
+            self.language = result.get("language")
+
+        segments = result["segments"]
+        consumed = take
+        if not is_last and len(segments) > 1:
+            # 最后一个片段可能在窗口边界被截断，留给下一个窗口重新识别
+            cut = int(segments[-1]["start"] * self.sr)
+            if cut > 0:
+                consumed = cut
+                segments = segments[:-1]
+
+        offset_seconds = self._offset / self.sr
+        new_segments = []
+        for seg in segments:
+            seg = dict(seg)
+            seg["id"] = len(self.segments) + len(new_segments)
+            seg["seek"] = int(offset_seconds * 100) + seg.get("seek", 0)
+            seg["start"] = round(seg["start"] + offset_seconds, 3)
+            seg["end"] = round(seg["end"] + offset_seconds, 3)
+            if "words" in seg:
+                seg["words"] = [
+                    {**w, "start": round(w["start"] + offset_seconds, 3), "end": round(w["end"] + offset_seconds, 3)}
+                    for w in seg["words"]
+                ]
+            new_segments.append(seg)
+        self.segments.extend(new_segments)
+
+        with self._lock:
+            buffer = np.concatenate(self._blocks) if len(self._blocks) > 1 else self._blocks[0]
+            self._blocks = [buffer[consumed:]] if consumed < len(buffer) else []
+            self._buffered = len(buffer) - consumed
+            self._offset += consumed
+
+        return new_segments
+
+    def result(self) -> Dict[str, Any]:
+        """汇总所有窗口，返回与 model.transcribe() 相同结构的结果"""
+        return {
+            "text": "".join(seg["text"] for seg in self.segments),
+            "segments": self.segments,
+            "language": self.language,
+            "alignment_time": self.alignment_time
+        }
@@ -111,6 +111,48 @@ def test_transcribe():
         if 'files' in locals() and 'audio' in files:
             files['audio'].close()
 
+# 测试流式上传转录接口
+def test_transcribe_stream():
+    """测试流式上传转录接口，请求体按块发送"""
+    url = "http://localhost:3000/api/transcribe-stream?model=tiny&language=zh"
+    
+    # 检查测试文件是否存在
+    test_file = "test.wav"
+    if not os.path.exists(test_file):
+        print(f"\n🧪 测试流式上传转录接口")
+        print(f"❌ 测试文件不存在: {test_file}")
+        return False
+    
+    # 分块读取文件，模拟慢速上传
+    def read_chunks():
+        with open(test_file, 'rb') as f:
+            while True:
+                chunk = f.read(16 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    
+    try:
+        print(f"\n🧪 测试流式上传转录接口")
+        print(f"📁 使用测试文件: {test_file}")
+        
+        response = requests.post(url, data=read_chunks(), headers={'Content-Type': 'audio/wav'})
+        
+        # 输出结果
+        print(f"📡 响应状态码: {response.status_code}")
+        print(f"📝 响应内容: {response.text}")
+        
+        if response.status_code == 200:
+            print("✅ 流式转录成功!")
+            return True
+        else:
+            print("❌ 流式转录失败!")
+            return False
+            
+    except Exception as e:
+        print(f"❌ 请求失败: {e}")
+        return False
+
 # 主测试函数
 def main():
     """运行所有测试"""
@@ -123,6 +165,7 @@ def main():
     results.append(test_models())
     results.append(test_languages())
     results.append(test_transcribe())
+    results.append(test_transcribe_stream())
     
     # 统计结果
     print("\n" + "=" * 50)
@@ -0,0 +1,64 @@
+import requests
+import os
+import shutil
+import time
+import wave
+import numpy as np
+
+# 创建测试归档目录
+def create_test_archive(dir_path="bulk_test_archive", count=3):
+    """创建包含若干个正弦波 WAV 文件的目录"""
+    os.makedirs(dir_path, exist_ok=True)
+    for i in range(count):
+        t = np.linspace(0, 1, 16000, endpoint=False)
+        data = (np.sin(2 * np.pi * (440 + i * 110) * t) * 32767).astype(np.int16)
+        with wave.open(os.path.join(dir_path, f"test_{i}.wav"), 'w') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(16000)
+            wf.writeframes(data.tobytes())
+    print(f"✅ 测试归档创建成功: {dir_path}，共 {count} 个文件")
+    return os.path.abspath(dir_path)
+
+# 测试批量归档转写接口
+def test_bulk_transcribe():
+    """提交批量转写任务并轮询状态，第二次提交应全部跳过"""
+    archive = create_test_archive()
+    # 结果写在服务端的结果目录下，实际路径以接口返回的 output 为准
+    output = None
+    url = "http://localhost:3000/api/bulk-transcribe"
+    
+    try:
+        for attempt in range(2):
+            response = requests.post(url, json={
+                "source": os.path.join(archive, "*.wav"),
+                "output": "bulk_test_results.jsonl",
+                "options": {"model": "tiny", "language": "zh"},
+                "workers": 2
+            })
+            print(f"\n🧪 第 {attempt + 1} 次提交，响应状态码: {response.status_code}")
+            job = response.json()["data"]
+            output = job["output"]
+            
+            while job["status"] in ("pending", "running"):
+                time.sleep(1)
+                job = requests.get(f"{url}/{job['jobId']}").json()["data"]
+            
+            print(f"📝 任务结果: {job}")
+            if job["status"] == "completed":
+                print("✅ 测试成功!")
+            else:
+                print(f"❌ 测试失败，任务状态: {job['status']}")
+                
+    except Exception as e:
+        print(f"❌ 请求错误: {e}")
+    finally:
+        if output and os.path.exists(output):
+            os.remove(output)
+            print(f"🗑️ 删除结果文件: {output}")
+        if os.path.exists(archive):
+            shutil.rmtree(archive)
+            print(f"🗑️ 删除测试归档: {archive}")
+
+if __name__ == "__main__":
+    test_bulk_transcribe()
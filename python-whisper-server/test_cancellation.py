@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+from cancellation import (
+    REASON_DEADLINE, REASON_DISCONNECTED, CancelToken, CancellationStats, InferenceCancelled
+)
+from coalescing import InflightCoalescer
+
+# 测试截止时间
+def test_cancel_token_deadline():
+    """超过 timeoutMs 后 check() 抛出 InferenceCancelled，并带上已解码的时长"""
+    print("\n🧪 测试取消标记的截止时间")
+    token = CancelToken(50)
+    assert token.cancelled_reason() is None
+    token.check()
+    time.sleep(0.06)
+    assert token.cancelled_reason() == REASON_DEADLINE
+
+    token.processed_seconds = 30.0
+    try:
+        token.check()
+        assert False, "应当抛出 InferenceCancelled"
+    except InferenceCancelled as e:
+        assert e.reason == REASON_DEADLINE
+        assert e.processed_seconds == 30.0
+        print(f"🛑 {e}")
+
+    # 先到的取消原因不会被覆盖
+    token = CancelToken(50)
+    token.cancel(REASON_DISCONNECTED)
+    time.sleep(0.06)
+    token.cancel(REASON_DEADLINE)
+    assert token.cancelled_reason() == REASON_DISCONNECTED
+
+    # 没有 timeoutMs 时不会自行取消
+    token = CancelToken()
+    assert token.deadline is None and token.cancelled_reason() is None
+    print("✅ 截止时间测试成功!")
+
+# 测试取消统计
+def test_cancellation_stats():
+    """已解码的时长不超过音频总时长"""
+    print("\n🧪 测试取消统计")
+    stats = CancellationStats()
+    stats.record(REASON_DEADLINE, 90, 30)
+    stats.record(REASON_DISCONNECTED, 20, 45)
+    assert stats.stats() == {
+        "cancelled": {REASON_DISCONNECTED: 1, REASON_DEADLINE: 1},
+        "cancelledAudioSeconds": 60.0,
+        "discardedAudioSeconds": 50.0
+    }
+    print("✅ 取消统计测试成功!")
+
+
+def wait_for_cancel(started: threading.Event, runs: list, cancel: CancelToken = None):
+    """模拟推理：记录每次调用，直到共享的取消标记被设置；取消后还要一段时间才能在窗口之间停下"""
+    runs.append(cancel)
+    started.set()
+    while cancel.cancelled_reason() is None:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    raise InferenceCancelled(cancel.reason)
+
+# 测试合并请求的取消
+def test_coalescer_cancel():
+    """只有最后一个等待方离开时才取消推理；已取消的推理不再合并新请求，而是重新发起"""
+    print("\n🧪 测试合并请求的取消")
+    started = threading.Event()
+    runs = []
+
+    async def run():
+        coalescer = InflightCoalescer()
+        waiters = [
+            asyncio.ensure_future(coalescer.run("key", wait_for_cancel, started, runs, cancel=CancelToken()))
+            for _ in range(2)
+        ]
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        shared = runs[0]
+
+        # 第一个等待方离开，推理继续
+        waiters[0].cancel()
+        await asyncio.sleep(0.1)
+        assert shared.cancelled_reason() is None
+
+        # 最后一个等待方以截止时间离开，推理按该原因取消
+        deadline = CancelToken()
+        deadline.cancel(REASON_DEADLINE)
+        last = asyncio.ensure_future(coalescer.run("key", wait_for_cancel, started, runs, cancel=deadline))
+        await asyncio.sleep(0)
+        waiters[1].cancel()
+        last.cancel()
+        await asyncio.gather(*waiters, last, return_exceptions=True)
+        assert shared.cancelled_reason() == REASON_DEADLINE
+
+        # 被取消的推理收尾前又来了相同的请求：重新发起，不继承取消状态
+        assert "key" in coalescer._inflight
+        started.clear()
+        retry = asyncio.ensure_future(coalescer.run("key", wait_for_cancel, started, runs, cancel=CancelToken()))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        assert len(runs) == 2 and runs[1] is not shared
+        assert runs[1].cancelled_reason() is None
+        runs[1].cancel(REASON_DISCONNECTED)
+        try:
+            await retry
+            assert False, "应当抛出 InferenceCancelled"
+        except InferenceCancelled as e:
+            assert e.reason == REASON_DISCONNECTED
+        await asyncio.sleep(0.3)
+        return coalescer
+
+    coalescer = asyncio.run(run())
+    assert coalescer.stats == {"leaders": 2, "coalesced": 2, "inflight": 0}
+    print(f"✅ 合并取消测试成功: {coalescer.stats}")
+
+if __name__ == "__main__":
+    test_cancel_token_deadline()
+    test_cancellation_stats()
+    test_coalescer_cancel()
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from coalescing import InflightCoalescer, coalesce_key
+from scheduler import RateLimitExceeded
+
+# 测试相同请求合并为一次计算
+def test_coalescer_join():
+    """相同 key 的并发请求只执行一次，结果共享；不同 key 各自执行"""
+    print("\n🧪 测试进行中请求合并")
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return value * 2
+
+    async def run():
+        coalescer = InflightCoalescer()
+        results = await asyncio.gather(
+            coalescer.run("a", work, 1),
+            coalescer.run("a", work, 1),
+            coalescer.run("a", work, 1),
+            coalescer.run("b", work, 5)
+        )
+        return coalescer, results
+
+    coalescer, results = asyncio.run(run())
+    assert results == [2, 2, 2, 10]
+    assert sorted(calls) == [1, 5]
+    assert coalescer.stats == {"leaders": 2, "coalesced": 2, "inflight": 0}
+    print(f"✅ 合并测试成功: {coalescer.stats}")
+
+# 测试被限流的计算不牵连合并进来的请求
+def test_follower_not_rate_limited_by_leader():
+    """发起方的计算因限流失败时，合并进来的其他客户端重新发起自己的计算，而不是收到别人的 429"""
+    print("\n🧪 测试合并请求与限流")
+    calls = []
+
+    def work(client_id):
+        calls.append(client_id)
+        time.sleep(0.2)
+        if client_id == "a":
+            raise RateLimitExceeded(client_id, 5)
+        return client_id
+
+    async def run():
+        coalescer = InflightCoalescer()
+        results = await asyncio.gather(
+            coalescer.run("key", work, "a"),
+            coalescer.run("key", work, "b"),
+            coalescer.run("key", work, "c"),
+            return_exceptions=True
+        )
+        return coalescer, results
+
+    coalescer, results = asyncio.run(run())
+    assert isinstance(results[0], RateLimitExceeded) and results[0].client_id == "a"
+    assert results[1:] == ["b", "b"]
+    assert calls == ["a", "b"]
+    assert coalescer.stats == {"leaders": 2, "coalesced": 3, "inflight": 0}
+    print(f"✅ 合并限流测试成功: {coalescer.stats}")
+
+# 测试合并键
+def test_coalesce_key():
+    """选项顺序不影响合并键，选项不同则不合并"""
+    print("\n🧪 测试合并键")
+    assert coalesce_key("abc", {"model": "tiny", "language": "zh"}) == coalesce_key("abc", {"language": "zh", "model": "tiny"})
+    assert coalesce_key("abc", {"model": "tiny"}) != coalesce_key("abc", {"model": "base"})
+    assert coalesce_key("abc", {"model": "tiny"}) != coalesce_key("abd", {"model": "tiny"})
+    print("✅ 合并键测试成功!")
+
+# 测试合并的本地文件转写请求（需要先启动服务）
+def test_transcribe_file_coalesced(file_path="coalesce_test.wav", count=3):
+    """同一个本地文件的并发请求合并后都应成功，且调用方的原始文件不能被删除"""
+    print("\n🧪 测试合并的本地文件转写请求")
+    t = np.linspace(0, 3, 48000, endpoint=False)
+    with wave.open(file_path, 'w') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes((np.sin(2 * np.pi * 440 * t) * 32767).astype(np.int16).tobytes())
+    url = "http://localhost:3000/api/transcribe-file"
+    barrier = threading.Barrier(count)
+
+    def post(_):
+        barrier.wait()
+        return requests.post(url, json={"filePath": os.path.abspath(file_path), "options": {"model": "tiny"}})
+
+    try:
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            statuses = [response.status_code for response in executor.map(post, range(count))]
+        print(f"📡 响应状态码: {statuses}")
+        if statuses == [200] * count and os.path.exists(file_path):
+            print("✅ 测试成功!")
+        else:
+            print(f"❌ 测试失败，原始文件{'仍然存在' if os.path.exists(file_path) else '已被删除'}")
+    except Exception as e:
+        print(f"❌ 请求错误: {e}")
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+if __name__ == "__main__":
+    test_coalescer_join()
+    test_follower_not_rate_limited_by_leader()
+    test_coalesce_key()
+    test_transcribe_file_coalesced()
@@ -0,0 +1,52 @@
+import torch
+
+from decoding import EncoderCache
+
+# 测试编码器缓存的容量限制
+def test_encoder_cache_lru():
+    """按字节数限制容量，超出时淘汰最久未使用的条目；单个条目超过容量时不缓存"""
+    print("\n🧪 测试编码器缓存的 LRU 淘汰")
+    # 每个条目 100 个 float32，共 400 字节
+    features = lambda value: torch.full((100,), float(value))
+    cache = EncoderCache(max_bytes=1000)
+
+    cache.put(("tiny", False, (1,), "a"), features(1))
+    cache.put(("tiny", False, (1,), "b"), features(2))
+    assert cache.get(("tiny", False, (1,), "a"))[0] == 1  # a 变为最近使用
+    cache.put(("base", False, (1,), "c"), features(3))
+    assert cache.get(("tiny", False, (1,), "b")) is None
+    assert cache.get(("tiny", False, (1,), "a")) is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["bytes"] == 800 and stats["evictions"] == 1
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["hitRate"] == round(2 / 3, 4)
+
+    # 重复写入同一个键不重复计数
+    cache.put(("tiny", False, (1,), "a"), features(4))
+    assert cache.get(("tiny", False, (1,), "a"))[0] == 1 and cache.stats()["bytes"] == 800
+
+    # 超过容量的条目直接跳过，不会挤掉已有条目
+    cache.put(("tiny", False, (1,), "big"), torch.zeros(300))
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    print(f"✅ LRU 淘汰测试成功: {cache.stats()}")
+
+# 测试按模型清空缓存
+def test_encoder_cache_clear():
+    """指定模型时只清该模型的条目，字节数同步减少；不指定时全部清空"""
+    print("\n🧪 测试按模型清空编码器缓存")
+    cache = EncoderCache(max_bytes=10000)
+    cache.put(("tiny", False, (1,), "a"), torch.zeros(100))
+    cache.put(("tiny", True, (1,), "a"), torch.zeros(100, dtype=torch.float16))
+    cache.put(("base", False, (1,), "a"), torch.zeros(100))
+
+    cache.clear("tiny")
+    assert cache.stats()["entries"] == 1 and cache.stats()["bytes"] == 400
+    assert cache.get(("base", False, (1,), "a")) is not None
+    cache.clear()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+    # 清空不算淘汰
+    assert cache.stats()["evictions"] == 0
+    print("✅ 按模型清空测试成功!")
+
+if __name__ == "__main__":
+    test_encoder_cache_lru()
+    test_encoder_cache_clear()
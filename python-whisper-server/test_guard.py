@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+from decoding import (
+    GuardConfig, HallucinationGuard, guard_stats, needs_fallback, parse_guard, repeated_tail, trim_repeated_tail
+)
+
+# 测试重复片段检测
+def test_repeated_tail():
+    """结尾的 n-gram 需要同时满足最少重复次数和最少覆盖 token 数"""
+    print("\n🧪 测试重复片段检测")
+    config = GuardConfig()
+
+    assert repeated_tail([7] * 16, config)
+    assert not repeated_tail([7] * 15, config)
+    assert repeated_tail([1, 2, 3] + [4, 5] * 8, config)
+    assert not repeated_tail([4, 5] * 8 + [6], config)
+    # 长片段只需重复 min_repeats 次
+    assert repeated_tail(list(range(10)) * 4, config)
+    assert not repeated_tail(list(range(10)) * 3, config)
+    # 超过 max_ngram 的片段不检测
+    assert not repeated_tail(list(range(13)) * 4, config)
+    assert repeated_tail([4, 5] * 4, GuardConfig(min_span=8))
+
+    assert trim_repeated_tail([1, 2, 3] + [4, 5] * 8, config) == [1, 2, 3, 4, 5]
+    assert trim_repeated_tail([1, 2, 3], config) == [1, 2, 3]
+    print("✅ 重复片段检测测试成功!")
+
+# 测试截断参数解析
+def test_parse_guard():
+    """默认关闭，需要请求显式开启"""
+    print("\n🧪 测试截断参数解析")
+    assert parse_guard(None) is None
+    assert parse_guard("false") is None
+    assert parse_guard("true") == GuardConfig()
+    assert parse_guard('{"minSpan": 8, "noSpeechThreshold": null}') == GuardConfig(min_span=8, no_speech_threshold=None)
+    assert parse_guard('{"enabled": false}') is None
+    for value in ('{"bogus": 1}', "{bad", "[1]", '{"minSpan": "8"}', '{"noSpeechThreshold": 2}'):
+        try:
+            parse_guard(value)
+            assert False, f"应当拒绝: {value}"
+        except ValueError as e:
+            print(f"🚫 {e}")
+    print("✅ 参数解析测试成功!")
+
+# 回归测试：重复截断后的结果不能再触发温度回退
+def test_trimmed_result_skips_fallback():
+    """截断的结果末尾仍是重复片段时压缩比过高，whisper 会在每个温度上重解；裁剪后不应再回退"""
+    print("\n🧪 测试重复截断后不再回退")
+    from whisper.decoding import DecodingResult
+    from whisper.tokenizer import get_tokenizer
+    from whisper.utils import compression_ratio
+
+    tokenizer = get_tokenizer(multilingual=True, language="en", task="transcribe")
+    task = SimpleNamespace(tokenizer=tokenizer, decoder=None, sample_len=224, sample_begin=3)
+    guard = HallucinationGuard(task, GuardConfig())
+
+    tokens = [tokenizer.timestamp_begin] + tokenizer.encode(" Thank you.") + tokenizer.encode(" la") * 30
+    text = tokenizer.decode(tokens).strip()
+    result = DecodingResult(
+        audio_features=None, language="en", tokens=tokens, text=text, avg_logprob=-0.2,
+        no_speech_prob=0.01, temperature=0.0, compression_ratio=compression_ratio(text)
+    )
+    assert needs_fallback(result)
+
+    trimmed = guard.trim(result)
+    assert trimmed.text == "Thank you. la"
+    assert trimmed.tokens == [tokenizer.timestamp_begin] + tokenizer.encode(" Thank you. la")
+    assert trimmed.compression_ratio <= 2.4
+    assert not needs_fallback(trimmed)
+    # 没有重复的结果保持不变
+    assert guard.trim(trimmed) is trimmed
+
+    # 只有结果不再回退时才计入节省的步数
+    guard_stats.take()
+    guard.repetition = True
+    guard.steps = 24
+    guard.finish(1.2, [result])
+    guard.finish(1.2, [trimmed])
+    stats = guard_stats.stats()
+    assert stats["repetitionCuts"] == 2
+    assert stats["tokensSaved"] == 200
+    assert stats["estimatedSecondsSaved"] == 10.0
+    guard_stats.take()
+    print(f"✅ 截断回归测试成功: {trimmed.text!r}，压缩比 {trimmed.compression_ratio:.2f}")
+
+if __name__ == "__main__":
+    test_repeated_tail()
+    test_parse_guard()
+    test_trimmed_result_skips_fallback()
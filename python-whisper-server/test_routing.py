@@ -0,0 +1,50 @@
+from routing import ModelRouter
+
+# 测试延迟目标内选择最大的模型
+def test_choose_fit():
+    """预计延迟在目标内时，选已加载模型中最大的一个"""
+    print("\n🧪 测试模型路由：延迟目标内")
+    router = ModelRouter(latency_target_ms=10000, fallback_model="tiny")
+    router.rtf.update({"tiny": 0.05, "base": 0.1, "small": 0.3, "medium": 0.8})
+
+    # 20 秒音频：small 预计 6s，medium 预计 16s
+    model_name, routing = router.choose(20, ["tiny", "small", "medium"])
+    assert model_name == "small"
+    assert routing["predictedLatencyMs"] == 6000
+    assert routing["candidates"] == ["tiny", "small", "medium"]
+
+    # 未加载的模型不参与选择
+    model_name, _ = router.choose(20, ["tiny", "base"])
+    assert model_name == "base"
+    assert router.downgrades == 0
+    print(f"✅ 路由测试成功: {router.snapshot()['decisions']}")
+
+# 测试所有模型都超出目标时回退
+def test_choose_downgrade():
+    """排队量使所有模型都超出目标时回退到最小的已加载模型，并计入降级次数"""
+    print("\n🧪 测试模型路由：降级")
+    router = ModelRouter(latency_target_ms=10000, fallback_model="tiny")
+    router.rtf.update({"tiny": 0.05, "base": 0.1, "small": 0.3})
+
+    # 排队中的 small 请求预计还要 12 秒
+    router.begin("small", 40)
+    model_name, routing = router.choose(10, ["base", "small"])
+    assert model_name == "base"
+    assert routing["queueDelayMs"] == 12000
+    assert router.downgrades == 1
+
+    # 排队请求结束后按实测耗时更新实时率，small 重新落入目标
+    router.end("small", 40, processing_seconds=8)
+    assert router.rtf["small"] == 0.2
+    model_name, _ = router.choose(10, ["base", "small"])
+    assert model_name == "small"
+
+    # 没有已加载的模型时使用默认模型
+    model_name, routing = router.choose(10, [])
+    assert model_name == "tiny"
+    assert routing["candidates"] == []
+    print(f"✅ 降级测试成功: {router.snapshot()}")
+
+if __name__ == "__main__":
+    test_choose_fit()
+    test_choose_downgrade()
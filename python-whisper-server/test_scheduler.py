@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from cancellation import REASON_DEADLINE, CancelToken, InferenceCancelled
+from scheduler import FairScheduler, RateLimitExceeded, run_inference
+
+
+def wait_queued(scheduler, depth, timeout=5):
+    """等待排队数量达到 depth"""
+    deadline = time.time() + timeout
+    while scheduler.queue_depth() < depth:
+        assert time.time() < deadline, "排队超时"
+        time.sleep(0.01)
+
+
+def hold_slot(scheduler, release):
+    """占住唯一的推理槽，直到 release 被设置"""
+    acquired = threading.Event()
+
+    def hold():
+        with scheduler.slot("holder", 1):
+            acquired.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    acquired.wait()
+    return thread
+
+# 测试加权公平排队的顺序
+def test_fair_ordering():
+    """大批量客户端先排队，交互式小请求仍然先拿到推理槽"""
+    print("\n🧪 测试公平调度顺序")
+    scheduler = FairScheduler(capacity=1, rate=0, weights={})
+    release = threading.Event()
+    holder = hold_slot(scheduler, release)
+    order = []
+
+    def job(client_id, cost, name):
+        with scheduler.slot(client_id, cost):
+            order.append(name)
+
+    threads = []
+    for i, (client_id, cost) in enumerate([("bulk", 60), ("bulk", 60), ("bulk", 60), ("interactive", 5)]):
+        thread = threading.Thread(target=job, args=(client_id, cost, f"{client_id}-{i}"))
+        thread.start()
+        threads.append(thread)
+        wait_queued(scheduler, i + 1)
+
+    release.set()
+    for thread in [holder] + threads:
+        thread.join()
+    assert order == ["interactive-3", "bulk-0", "bulk-1", "bulk-2"]
+    snapshot = scheduler.snapshot()
+    assert snapshot["clients"]["bulk"]["requests"] == 3
+    assert snapshot["active"] == 0 and snapshot["queued"] == 0
+    print(f"✅ 调度顺序: {order}")
+
+# 测试令牌桶限流
+def test_rate_limit():
+    """超出令牌桶时返回需要等待的秒数，各客户端独立计算；桶满时允许单个超长请求"""
+    print("\n🧪 测试令牌桶限流")
+    scheduler = FairScheduler(capacity=1, rate=1, burst=10, weights={})
+    scheduler.admit("a", 8)
+    try:
+        scheduler.admit("a", 5)
+        assert False, "应当被限流"
+    except RateLimitExceeded as e:
+        assert e.client_id == "a"
+        assert 2.5 < e.retry_after <= 3
+        print(f"🚦 被限流: {e}")
+    scheduler.admit("b", 5)
+    scheduler.admit("c", 100)
+    assert scheduler.snapshot()["clients"]["a"]["rejected"] == 1
+    print("✅ 限流测试成功!")
+
+# 测试后台任务等待令牌
+def test_wait_admit():
+    """后台任务超出限额时等待令牌补足而不是被拒绝；停止后放弃等待"""
+    print("\n🧪 测试等待令牌")
+    scheduler = FairScheduler(capacity=1, rate=10, burst=5, weights={})
+    scheduler.wait_admit("bulk", 5)
+    start_time = time.time()
+    assert scheduler.wait_admit("bulk", 3)
+    assert 0.2 < time.time() - start_time < 1
+    client = scheduler.snapshot()["clients"]["bulk"]
+    assert client["rejected"] == 0 and client["throttleSeconds"] > 0.2
+
+    stop_event = threading.Event()
+    threading.Timer(0.1, stop_event.set).start()
+    start_time = time.time()
+    assert not scheduler.wait_admit("bulk", 5, stop_event)
+    assert time.time() - start_time < 0.4
+    print(f"✅ 等待令牌测试成功: {client}")
+
+# 测试排队期间取消
+def test_cancel_withdraws_queue():
+    """排队中的请求超过截止时间后撤回，不再占用队列"""
+    print("\n🧪 测试排队期间取消")
+    scheduler = FairScheduler(capacity=1, rate=0, weights={})
+    release = threading.Event()
+    holder = hold_slot(scheduler, release)
+    start_time = time.time()
+    try:
+        with scheduler.slot("waiting", 10, CancelToken(200)):
+            assert False, "不应拿到推理槽"
+    except InferenceCancelled as e:
+        assert e.reason == REASON_DEADLINE
+    assert time.time() - start_time < 2
+    assert scheduler.queue_depth() == 0
+    assert scheduler.snapshot()["clients"]["waiting"]["queued"] == 0
+
+    release.set()
+    holder.join()
+    with scheduler.slot("next", 1):
+        assert scheduler.snapshot()["active"] == 1
+    print("✅ 取消撤回测试成功!")
+
+# 测试排队中的推理不占用默认线程池
+def test_queued_inference_keeps_threadpool_free():
+    """大量推理在推理专用线程池中排队时，run_in_threadpool 的短任务仍能立即执行"""
+    print("\n🧪 测试推理专用线程池")
+    scheduler = FairScheduler(capacity=1, rate=0, weights={})
+    release = threading.Event()
+    holder = hold_slot(scheduler, release)
+
+    def infer():
+        with scheduler.slot("client", 1):
+            pass
+
+    async def run():
+        tasks = [asyncio.ensure_future(run_inference(infer)) for _ in range(60)]
+        try:
+            await asyncio.sleep(0.2)
+            return await asyncio.wait_for(run_in_threadpool(lambda: "ok"), timeout=2)
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == "ok"
+    holder.join()
+    assert scheduler.snapshot()["clients"]["client"]["requests"] == 60
+    print("✅ 推理线程池测试成功!")
+
+if __name__ == "__main__":
+    test_fair_ordering()
+    test_rate_limit()
+    test_wait_admit()
+    test_cancel_withdraws_queue()
+    test_queued_inference_keeps_threadpool_free()
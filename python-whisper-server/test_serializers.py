@@ -0,0 +1,76 @@
+from serializers import _accepts_gzip, project, segments_to_srt
+
+# 测试用的转写结果
+RESULT = {
+    "text": "你好 世界",
+    "language": "zh",
+    "chunks": [
+        {"start": 0.0, "end": 1.5, "text": "你好", "tokens": [1, 2], "avg_logprob": -0.1},
+        {"start": 1.5, "end": 3.25, "text": " 世界", "tokens": [3], "avg_logprob": -0.2}
+    ]
+}
+
+# 测试 fields 参数裁剪
+def test_project():
+    """包含、排除以及两种写法混用"""
+    print("\n🧪 测试 fields 字段裁剪")
+
+    assert project(RESULT, None) is RESULT
+    assert project(RESULT, "text,chunks.start") == {
+        "text": "你好 世界",
+        "chunks": [{"start": 0.0}, {"start": 1.5}]
+    }
+    assert project(RESULT, "-chunks.tokens,-chunks.avg_logprob,-language") == {
+        "text": "你好 世界",
+        "chunks": [
+            {"start": 0.0, "end": 1.5, "text": "你好"},
+            {"start": 1.5, "end": 3.25, "text": " 世界"}
+        ]
+    }
+    # 选中整个 chunks 后再排除其中的字段
+    assert project(RESULT, "chunks,-chunks.tokens,-chunks.avg_logprob")["chunks"][0] == {
+        "start": 0.0, "end": 1.5, "text": "你好"
+    }
+    # 不存在的字段直接忽略
+    assert project(RESULT, "text,missing") == {"text": "你好 世界"}
+    print("✅ 字段裁剪测试成功!")
+
+# 测试 SRT 字幕生成
+def test_segments_to_srt():
+    """序号从 1 开始、时间戳使用逗号、空白片段跳过、带词级时间戳时按长度切分"""
+    print("\n🧪 测试 SRT 字幕生成")
+
+    segments = RESULT["chunks"] + [{"start": 3.25, "end": 4.0, "text": "  "}]
+    assert segments_to_srt(segments) == (
+        "1\n00:00:00,000 --> 00:00:01,500\n你好\n\n"
+        "2\n00:00:01,500 --> 00:00:03,250\n世界\n"
+    )
+
+    words = [{"word": f" word{i:02d}", "start": float(i), "end": i + 0.5} for i in range(10)]
+    srt = segments_to_srt([{"start": 0.0, "end": 10.0, "text": "".join(w["word"] for w in words), "words": words}])
+    cues = [block.split("\n") for block in srt.strip().split("\n\n")]
+    assert len(cues) == 2
+    assert cues[0][1] == "00:00:00,000 --> 00:00:05,500"
+    assert cues[1][1] == "00:00:06,000 --> 00:00:09,500"
+    assert all(len(cue[2]) <= 42 for cue in cues)
+    print("✅ SRT 字幕测试成功!")
+
+# 测试 Accept-Encoding 解析
+def test_accepts_gzip():
+    """q=0 表示明确拒绝 gzip"""
+    print("\n🧪 测试 Accept-Encoding 解析")
+
+    assert _accepts_gzip("gzip, deflate, br")
+    assert _accepts_gzip("br;q=1.0, GZIP;q=0.5")
+    assert _accepts_gzip("*")
+    assert not _accepts_gzip(None)
+    assert not _accepts_gzip("")
+    assert not _accepts_gzip("br, deflate")
+    assert not _accepts_gzip("gzip;q=0")
+    assert not _accepts_gzip("gzip; q=0.0, br")
+    print("✅ Accept-Encoding 测试成功!")
+
+if __name__ == "__main__":
+    test_project()
+    test_segments_to_srt()
+    test_accepts_gzip()
@@ -0,0 +1,150 @@
+import struct
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from streaming import (
+    WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+    StreamingResampler, StreamingWavDecoder, WindowedTranscriber
+)
+
+
+def random_chunks(data, rng, max_size):
+    """把数组或字节串切成随机大小的块，块大小可能为 1"""
+    start = 0
+    while start < len(data):
+        size = int(rng.integers(1, max_size + 1))
+        yield data[start:start + size]
+        start += size
+
+
+def build_wav(frames: bytes, channels: int, sample_rate: int, bits: int, format_tag: int = WAVE_FORMAT_PCM,
+              extensible: bool = False, data_size: int = None) -> bytes:
+    """拼出 WAV 字节：fmt 块之后带一个奇数长度的 LIST 块，data_size 可写成 0 / 0xFFFFFFFF 模拟流式生成的文件"""
+    block_align = channels * bits // 8
+    fmt = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else format_tag,
+                      channels, sample_rate, sample_rate * block_align, block_align, bits)
+    if extensible:
+        # cbSize、有效位数、声道掩码，SubFormat GUID 的前两个字节是真实格式码
+        fmt += struct.pack("<HHI", 22, bits, 0) + struct.pack("<H", format_tag) + bytes(14)
+    info = b"INFOabc"
+    body = (b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"LIST" + struct.pack("<I", len(info)) + info + b"\0"
+            + b"data" + struct.pack("<I", len(frames) if data_size is None else data_size) + frames)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def decode_in_chunks(wav: bytes, rng) -> np.ndarray:
+    decoder = StreamingWavDecoder()
+    parts = [decoder.feed(chunk) for chunk in random_chunks(wav, rng, 97)]
+    parts.append(decoder.finish())
+    return np.concatenate(parts)
+
+# 测试分块重采样
+def test_streaming_resampler():
+    """任意大小的分块（包括 1 个样本的块）拼接后与 resample_poly 一次性重采样整段音频的结果相同"""
+    print("\n🧪 测试分块重采样")
+    rng = np.random.default_rng(0)
+    for source_sr in (44100, 48000, 8000, 22050, 16000):
+        audio = rng.standard_normal(source_sr // 2 + 7).astype(np.float32)
+        resampler = StreamingResampler(source_sr)
+        parts = [resampler.process(block) for block in random_chunks(audio, rng, 3000)]
+        parts.append(resampler.flush())
+        streamed = np.concatenate(parts)
+
+        expected = audio if source_sr == 16000 else resample_poly(audio, resampler.up, resampler.down)
+        assert len(streamed) == len(expected), (source_sr, len(streamed), len(expected))
+        assert np.allclose(streamed, expected, atol=1e-5), (source_sr, np.abs(streamed - expected).max())
+        print(f"✅ {source_sr}Hz → 16000Hz: {len(streamed)} 个样本，最大误差 {np.abs(streamed - expected).max():.2e}")
+
+# 测试 24 位立体声 WAV
+def test_decoder_24bit_stereo():
+    """24 位立体声按声道取平均，数据块前的 LIST 块被跳过"""
+    print("\n🧪 测试 24 位立体声 WAV")
+    rng = np.random.default_rng(1)
+    samples = rng.integers(-2 ** 23, 2 ** 23, size=(1600, 2), dtype=np.int32)
+    frames = samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    audio = decode_in_chunks(build_wav(frames, 2, 16000, 24), rng)
+    expected = (samples / 2 ** 23).mean(axis=1)
+    assert len(audio) == 1600 and np.allclose(audio, expected, atol=1e-6)
+    print("✅ 24 位立体声测试成功!")
+
+# 测试 WAVE_FORMAT_EXTENSIBLE
+def test_decoder_extensible():
+    """扩展格式按 SubFormat 中的格式码解码，整数 PCM 和 32 位浮点都支持"""
+    print("\n🧪 测试 WAVE_FORMAT_EXTENSIBLE")
+    rng = np.random.default_rng(2)
+    pcm = rng.integers(-32768, 32768, size=1600, dtype=np.int16)
+    audio = decode_in_chunks(build_wav(pcm.tobytes(), 1, 16000, 16, WAVE_FORMAT_PCM, extensible=True), rng)
+    assert np.allclose(audio, pcm / 32768.0)
+
+    floats = rng.uniform(-1, 1, size=(1600, 2)).astype(np.float32)
+    audio = decode_in_chunks(build_wav(floats.tobytes(), 2, 16000, 32, WAVE_FORMAT_IEEE_FLOAT, extensible=True), rng)
+    assert np.allclose(audio, floats.mean(axis=1), atol=1e-7)
+    print("✅ 扩展格式测试成功!")
+
+# 测试 data 长度未知的 WAV
+def test_decoder_unknown_data_length():
+    """data 长度写成 0 或 0xFFFFFFFF 时一直读到上传结束；长度已知时忽略 data 块之后的内容"""
+    print("\n🧪 测试 data 长度未知的 WAV")
+    rng = np.random.default_rng(3)
+    pcm = rng.integers(-32768, 32768, size=4000, dtype=np.int16)
+    for data_size in (0, 0xFFFFFFFF):
+        audio = decode_in_chunks(build_wav(pcm.tobytes(), 1, 16000, 16, data_size=data_size), rng)
+        assert len(audio) == 4000 and np.allclose(audio, pcm / 32768.0)
+
+    trailer = b"LIST" + struct.pack("<I", 4) + b"INFO"
+    audio = decode_in_chunks(build_wav(pcm.tobytes(), 1, 16000, 16) + trailer, rng)
+    assert len(audio) == 4000
+    print("✅ data 长度未知测试成功!")
+
+# 测试跨窗口的片段偏移和编号
+def test_windowed_transcriber_offsets():
+    """未确认的最后一个片段留给下一个窗口；片段时间、seek 和编号按窗口在整段音频中的位置连续递增"""
+    print("\n🧪 测试跨窗口的片段偏移")
+    sr = 100
+    prompts = []
+
+    def transcribe(window, prompt):
+        # 每 10 秒一个片段，最后一个片段在窗口末尾截断
+        prompts.append(prompt)
+        seconds = len(window) / sr
+        starts = np.arange(0, seconds, 10.0)
+        return {
+            "language": "zh",
+            "segments": [
+                {"id": 0, "seek": 0, "start": float(start), "end": float(min(start + 10, seconds)),
+                 "text": f"[{int(start)}]", "words": [{"word": "x", "start": float(start), "end": float(start) + 1}]}
+                for start in starts
+            ]
+        }
+
+    transcriber = WindowedTranscriber(transcribe, window_seconds=30, sr=sr)
+    transcriber.append(np.zeros(25 * sr, dtype=np.float32))
+    assert not transcriber.has_full_window()
+    transcriber.append(np.zeros(25 * sr, dtype=np.float32))
+    assert transcriber.has_full_window()
+
+    first = transcriber.step()
+    assert [(seg["id"], seg["start"], seg["end"]) for seg in first] == [(0, 0.0, 10.0), (1, 10.0, 20.0)]
+    assert transcriber.offset_samples == 20 * sr and transcriber.total_samples == 50 * sr
+
+    second = transcriber.step(final=True)
+    assert [(seg["id"], seg["start"], seg["end"]) for seg in second] == [(2, 20.0, 30.0), (3, 30.0, 40.0), (4, 40.0, 50.0)]
+    assert [seg["seek"] for seg in second] == [2000] * 3
+    assert second[0]["words"][0]["start"] == 20.0 and second[0]["words"][0]["end"] == 21.0
+    assert prompts == [None, "[0][10]"]
+    assert not transcriber.has_pending()
+
+    result = transcriber.result()
+    assert [seg["id"] for seg in result["segments"]] == list(range(5))
+    assert result["text"] == "[0][10][0][10][20]" and result["language"] == "zh" and transcriber.windows == 2
+    print("✅ 跨窗口偏移测试成功!")
+
+if __name__ == "__main__":
+    test_streaming_resampler()
+    test_decoder_24bit_stereo()
+    test_decoder_extensible()
+    test_decoder_unknown_data_length()
+    test_windowed_transcriber_offsets()
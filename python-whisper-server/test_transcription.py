@@ -0,0 +1,81 @@
+import numpy as np
+import torch
+
+import inference
+import transcription
+from decoding import encoder_cache, mel_stats
+from transcription import parse_tasks
+
+# 测试多任务参数解析
+def test_parse_tasks():
+    """支持逗号分隔和 JSON 数组两种写法，未指定语言时使用请求的语言"""
+    print("\n🧪 测试多任务参数解析")
+    assert parse_tasks(None, "zh") == [] and parse_tasks("", "zh") == []
+    assert parse_tasks("transcribe, translate:en", "zh") == [
+        {"subtask": "transcribe", "language": "zh"},
+        {"subtask": "translate", "language": "en"}
+    ]
+    assert parse_tasks('[{"subtask": "translate", "language": "ja"}, {}]', "zh") == [
+        {"subtask": "translate", "language": "ja"},
+        {"subtask": "transcribe", "language": "zh"}
+    ]
+    assert parse_tasks(["translate", {"language": "en"}], "zh") == [
+        {"subtask": "translate", "language": "zh"},
+        {"subtask": "transcribe", "language": "en"}
+    ]
+
+    # JSON 不合法、不是列表、元素类型不对、任务不支持时都抛出 ValueError
+    for value in ("[bad", {"subtask": "translate"}, "[1]", '[["translate"]]', "summarize", '[{"subtask": "align"}]'):
+        try:
+            parse_tasks(value, "zh")
+            assert False, f"应当拒绝: {value}"
+        except ValueError as e:
+            print(f"🚫 {e}")
+    print("✅ 多任务参数解析测试成功!")
+
+# 测试多任务请求复用频谱和编码器输出
+def test_tasks_share_mel_and_encoder():
+    """同一段音频的两个任务：log-mel 频谱只计算一次，第二个任务的每个窗口都命中编码器缓存"""
+    print("\n🧪 测试多任务复用频谱和编码器输出")
+    from whisper.model import ModelDimensions, Whisper
+
+    # 随机初始化的小模型，只验证缓存路径，不关心转写内容
+    torch.manual_seed(0)
+    model = Whisper(ModelDimensions(
+        n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2, n_audio_layer=1,
+        n_vocab=51865, n_text_ctx=448, n_text_state=64, n_text_head=2, n_text_layer=1
+    )).eval()
+    # 解码器的位置编码用 torch.empty 创建，未初始化的值可能是 nan
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.01)
+    inference.get_whisper()
+    inference.install_decode_hooks(model, "tiny")
+    inference.model_cache["tiny"] = model
+    encoder_cache.clear()
+    try:
+        t = np.arange(16000 * 3) / 16000
+        audio = (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+        options = {"model": "tiny", "language": "en", "tasks": parse_tasks("transcribe,translate", "en")}
+        before_mel = dict(mel_stats)
+        before_cache = encoder_cache.stats()
+
+        result, _ = transcription.transcribe_tasks(audio, options)
+        assert [task["task"] for task in result["tasks"]] == ["transcribe", "translate"]
+        assert mel_stats["computed"] - before_mel["computed"] == 1
+        assert mel_stats["reused"] - before_mel["reused"] == 1
+
+        # 第一个任务的每个窗口未命中一次，第二个任务的同一窗口全部命中
+        stats = encoder_cache.stats()
+        misses = stats["misses"] - before_cache["misses"]
+        assert misses >= 1 and stats["hits"] - before_cache["hits"] >= misses
+
+        # 范围外的调用照常计算
+        transcription.transcribe_audio(audio, {"model": "tiny", "language": "en"})
+        assert mel_stats["computed"] - before_mel["computed"] == 2
+        print(f"✅ 多任务复用测试成功: mel {mel_stats}, 编码器缓存 {encoder_cache.stats()}")
+    finally:
+        inference.model_cache.pop("tiny", None)
+        encoder_cache.clear()
+
+if __name__ == "__main__":
+    test_parse_tasks()
+    test_tasks_share_mel_and_encoder()
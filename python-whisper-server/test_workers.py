@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import workers
+from cancellation import REASON_DEADLINE, REASON_DISCONNECTED, CancelToken, InferenceCancelled
+from workers import CANCEL_FLAGS, InferencePool, SharedAudioBlocks
+
+
+def block_exists(name: str) -> bool:
+    """共享内存块是否仍可按名字映射"""
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    block.close()
+    return True
+
+
+def run_pool(fake_transcribe, cancel=None, busy=None):
+    """用线程池代替进程池执行 worker_transcribe，fake_transcribe 代替模型推理；返回 (结果或异常, 进程池, 块名)"""
+    pool = InferencePool(workers=1)
+    pool._executor = ThreadPoolExecutor(max_workers=1)
+    if busy is not None:
+        # 先占住唯一的工作线程，请求在线程池队列中排队
+        pool._executor.submit(busy.wait)
+    names = []
+    original_put = pool.blocks.put
+
+    def put(audio):
+        descriptor = original_put(audio)
+        names.append(descriptor["name"])
+        return descriptor
+
+    pool.blocks.put = put
+    original = workers.run_transcribe
+    workers.run_transcribe = fake_transcribe
+    try:
+        outcome = pool.transcribe("tiny", np.arange(1600, dtype=np.float32), {}, cancel=cancel)
+    except BaseException as e:
+        outcome = e
+    finally:
+        workers.run_transcribe = original
+        if busy is not None:
+            busy.set()
+        pool._executor.shutdown(wait=True)
+    return outcome, pool, names[0]
+
+# 测试共享内存块的写入、取消标记和回收
+def test_shared_audio_blocks():
+    """音频写入共享内存，取消标记写在音频之后的一个字节，回收后按名字再也映射不到"""
+    print("\n🧪 测试共享内存块")
+    blocks = SharedAudioBlocks()
+    audio = np.linspace(-1, 1, 4000, dtype=np.float32)
+    descriptor = blocks.put(audio)
+    assert descriptor["samples"] == 4000
+    assert blocks.stats()["live"] == 1 and blocks.stats()["bytes"] >= audio.nbytes + 1
+
+    block = shared_memory.SharedMemory(name=descriptor["name"])
+    try:
+        assert np.array_equal(np.ndarray((4000,), dtype=np.float32, buffer=block.buf), audio)
+        assert block.buf[audio.nbytes] == 0
+        blocks.cancel(descriptor, REASON_DEADLINE)
+        assert block.buf[audio.nbytes] == CANCEL_FLAGS[REASON_DEADLINE]
+        token = workers.SharedFlagToken(block, audio.nbytes)
+        assert token.cancelled_reason() == REASON_DEADLINE
+    finally:
+        block.close()
+
+    blocks.release(descriptor)
+    blocks.release(descriptor)  # 重复回收不报错
+    assert not block_exists(descriptor["name"])
+    stats = blocks.stats()
+    assert stats["live"] == 0 and stats["bytes"] == 0 and stats["created"] == 1 and stats["released"] == 1
+    print(f"✅ 共享内存块测试成功: {stats}")
+
+# 测试推理成功和失败后回收共享内存
+def test_blocks_released_on_success_and_error():
+    """工作进程读到与 HTTP 进程相同的音频；无论推理成功还是抛出异常，共享内存块都会被回收"""
+    print("\n🧪 测试成功 / 失败后回收共享内存")
+
+    def succeed(model_name, audio, transcribe_options, guard, on_window, cancel):
+        return {"text": f"{audio.sum():.0f}", "segments": []}, 0.1
+
+    result, pool, name = run_pool(succeed)
+    assert result == ({"text": f"{np.arange(1600).sum():.0f}", "segments": []}, 0.1)
+    assert not block_exists(name)
+    assert pool.blocks.stats()["live"] == 0 and pool.blocks.stats()["released"] == 1
+
+    def fail(model_name, audio, transcribe_options, guard, on_window, cancel):
+        raise RuntimeError("模型加载失败")
+
+    error, pool, name = run_pool(fail)
+    assert isinstance(error, RuntimeError)
+    assert not block_exists(name)
+    assert pool.blocks.stats()["live"] == 0
+    print("✅ 成功 / 失败回收测试成功!")
+
+# 测试取消时写入标记字节并回收共享内存
+def test_blocks_released_on_cancel():
+    """推理中取消时写入标记字节，工作进程据此停止；排队中取消时任务直接撤回；两种情况都回收共享内存"""
+    print("\n🧪 测试取消后回收共享内存")
+    seen_flags = []
+
+    def wait_for_flag(model_name, audio, transcribe_options, guard, on_window, cancel):
+        while cancel.cancelled_reason() is None:
+            time.sleep(0.01)
+        seen_flags.append(cancel._block.buf[cancel._offset])
+        raise InferenceCancelled(cancel.reason)
+
+    cancel = CancelToken(200)
+    error, pool, name = run_pool(wait_for_flag, cancel)
+    assert isinstance(error, InferenceCancelled) and error.reason == REASON_DEADLINE
+    assert seen_flags == [CANCEL_FLAGS[REASON_DEADLINE]]
+    assert not block_exists(name)
+    assert pool.blocks.stats()["live"] == 0
+
+    # 工作线程被占住，请求还在排队时取消
+    calls = []
+    cancel = CancelToken()
+    threading.Timer(0.2, cancel.cancel, args=(REASON_DISCONNECTED,)).start()
+    error, pool, name = run_pool(lambda *args: calls.append(args), cancel, busy=threading.Event())
+    assert isinstance(error, InferenceCancelled) and error.reason == REASON_DISCONNECTED
+    assert calls == []
+    assert not block_exists(name)
+    assert pool.blocks.stats()["live"] == 0
+    print("✅ 取消回收测试成功!")
+
+if __name__ == "__main__":
+    test_shared_audio_blocks()
+    test_blocks_released_on_success_and_error()
+    test_blocks_released_on_cancel()
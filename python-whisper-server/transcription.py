@@ -0,0 +1,213 @@
+"""请求级转写流程：模型路由、公平调度、多任务和多进程推理
+
+main.py 的各个接口和 bulk_transcribe.py 都通过 transcribe_audio() 转写；单次推理由 inference.py 完成。
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from cancellation import CancelToken, InferenceCancelled, cancellation_stats
+from decoding import parse_guard, reuse_mel
+from inference import custom_load_audio, get_model_lock, model_cache, run_transcribe
+from progress import progress_payload
+from routing import ModelRouter
+from scheduler import INFERENCE_CONCURRENCY, FairScheduler
+from workers import INFERENCE_WORKERS, InferencePool
+
+# model=auto 的路由策略，同时记录各模型的实测速度和排队量
+model_router = ModelRouter()
+
+# 按客户端公平调度推理，并按音频时长限流；多进程推理时每个工作进程一个推理槽
+scheduler = FairScheduler(max(INFERENCE_CONCURRENCY, INFERENCE_WORKERS))
+
+# 启动后在后台预加载的模型，逗号分隔，例如 "tiny,base"
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("WHISPER_PRELOAD_MODELS", "").split(",") if name.strip()]
+
+# 多进程推理（WHISPER_INFERENCE_WORKERS > 0）时的工作进程池，音频经共享内存交给工作进程
+inference_pool = InferencePool(INFERENCE_WORKERS, PRELOAD_MODELS) if INFERENCE_WORKERS > 0 else None
+
+# 支持的模型列表
+SUPPORTED_MODELS = [
+    "tiny",
+    "base",
+    "small",
+    "medium",
+    "large"
+]
+
+# 已加载的模型：多进程推理时为各工作进程加载过的模型
+def loaded_models() -> List[str]:
+    if inference_pool is not None:
+        return list(inference_pool.models)
+    return list(model_cache)
+
+# 解析多任务参数：JSON 数组（[{"subtask": "translate", "language": "ja"}]）或逗号分隔（"transcribe,translate:en"）
+def parse_tasks(tasks: Optional[Union[str, List[Any]]], default_language: str) -> List[Dict[str, str]]:
+    if not tasks:
+        return []
+    if isinstance(tasks, str):
+        tasks = tasks.strip()
+        if tasks.startswith("["):
+            try:
+                tasks = json.loads(tasks)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"tasks 不是合法的 JSON: {e}") from e
+        else:
+            tasks = [item.strip() for item in tasks.split(",") if item.strip()]
+    if not isinstance(tasks, list):
+        raise ValueError("tasks 必须是列表或逗号分隔的字符串")
+    
+    parsed = []
+    for task in tasks:
+        if not isinstance(task, (str, dict)):
+            raise ValueError(f"不支持的任务格式: {task!r}")
+        if isinstance(task, str):
+            subtask, _, language = task.partition(":")
+            task = {"subtask": subtask, "language": language or default_language}
+        subtask = task.get("subtask", "transcribe")
+        if subtask not in ("transcribe", "translate"):
+            raise ValueError(f"不支持的任务: {subtask}，支持的任务有: ['transcribe', 'translate']")
+        parsed.append({"subtask": subtask, "language": task.get("language") or default_language})
+    return parsed
+
+# 请求的限流成本：音频时长 × 任务数
+def request_cost(audio_seconds: float, options: Dict[str, Any]) -> float:
+    return audio_seconds * max(1, len(options.get("tasks") or []))
+
+# 后台批量转写：令牌不足时等待补足，不会因为限流把文件记为失败；stop_event 被设置时放弃等待
+def transcribe_bulk(audio: np.ndarray, options: Dict[str, Any], client_id: str = "local",
+                    stop_event: Optional[threading.Event] = None):
+    if not scheduler.wait_admit(client_id, request_cost(len(audio) / 16000, options), stop_event):
+        raise RuntimeError("批量转写已停止，未开始推理")
+    return transcribe_audio(audio, options, client_id)
+
+# 同一段音频执行多个任务/语言：音频只解码一次，log-mel 频谱只计算一次，后续任务直接命中编码器缓存
+# 多进程推理时每个任务是一次独立的工作进程调用，频谱在工作进程中各自计算，编码器输出仍按窗口缓存
+def transcribe_tasks(audio: np.ndarray, options: Dict[str, Any], client_id: str = "local",
+                     progress: Optional[Callable] = None, cancel: Optional[CancelToken] = None):
+    start_time = time.time()
+    base_options = {k: v for k, v in options.items() if k != "tasks"}
+    
+    results = []
+    with reuse_mel():
+        for task in options["tasks"]:
+            result, processing_time = transcribe_audio(audio, {**base_options, **task}, client_id, progress, cancel)
+            # model=auto 时所有任务使用第一个任务选定的模型
+            if "routing" in result:
+                base_options["model"] = result["routing"]["model"]
+            results.append({
+                "task": task["subtask"],
+                "language": result["language"],
+                "text": result["text"],
+                "chunks": result["segments"],
+                "processingTime": int(processing_time * 1000)
+            })
+            if len(results) == 1:
+                primary = result
+    
+    primary["tasks"] = results
+    return primary, time.time() - start_time
+
+# 音频转文本核心函数
+def transcribe_audio(audio: Union[str, np.ndarray], options: Dict[str, Any], client_id: str = "local",
+                     progress: Optional[Callable] = None, cancel: Optional[CancelToken] = None):
+    """音频转文本核心处理，audio 可以是文件路径，也可以是已解码的 16kHz 音频数组；client_id 用于公平调度
+    限流不在这里检查：调用方在转写（以及请求合并）之前按 request_cost() 调用 scheduler.admit()
+
+    传入 progress 时，每个 30 秒窗口解码完成后以进度消息（新增片段和已处理秒数）调用一次；
+    传入 cancel 时，排队期间和每个窗口解码前检查是否已取消，取消时抛出 InferenceCancelled
+    """
+    start_time = time.time()
+    
+    # 先解码音频，路由和排队统计都需要知道音频时长
+    if isinstance(audio, str):
+        audio = custom_load_audio(audio)
+    audio = audio.astype(np.float32, copy=False)
+    
+    # 一个请求包含多个任务时逐个执行
+    if options.get("tasks"):
+        return transcribe_tasks(audio, options, client_id, progress, cancel)
+    audio_seconds = len(audio) / 16000
+    
+    # 处理模型名称
+    model_name = options.get("model", "tiny")
+    routing = None
+    
+    if model_name == "auto":
+        # 在已加载的模型中按时长、排队量和延迟目标选择
+        model_name, routing = model_router.choose(audio_seconds, loaded_models())
+        print(f"🧭 自动路由到模型: {model_name}（{routing['reason']}）")
+    
+    # 如果是完整模型名称（如 Xenova/whisper-tiny），提取简写
+    if "/" in model_name:
+        model_name = model_name.split("-")[-1]
+    
+    # 确保模型名称有效
+    if model_name not in SUPPORTED_MODELS:
+        raise ValueError(f"不支持的模型: {model_name}，支持的模型有: {SUPPORTED_MODELS}")
+    
+    # 幻觉/重复截断配置，参数错误时在排队前报错
+    guard = parse_guard(options.get("hallucinationGuard"))
+    
+    # 词级时间戳需要额外的对齐计算，只在请求时开启
+    word_timestamps = str(options.get("wordTimestamps", False)).lower() == "true"
+    
+    # 设置转录选项
+    transcribe_options = {
+        "language": options.get("language", "zh"),
+        "task": options.get("subtask", "transcribe"),
+        "word_timestamps": word_timestamps,
+        "verbose": False
+    }
+    
+    # 流式转写时把上一个窗口的文本作为提示
+    if options.get("initial_prompt"):
+        transcribe_options["initial_prompt"] = options["initial_prompt"]
+    
+    print(f"🎤 正在转录音频，使用模型: {model_name}")
+    print(f"🌍 语言: {transcribe_options['language']}")
+    print(f"📋 任务: {transcribe_options['task']}")
+    
+    on_window = None
+    if progress is not None:
+        on_window = lambda segments, processed: progress(
+            progress_payload(transcribe_options["task"], segments, processed, audio_seconds)
+        )
+    
+    # 执行转录：先按客户端公平排队拿到推理槽，同一模型的推理串行进行
+    # 多进程推理时每个工作进程各有一份模型，不需要模型锁
+    inference_time = None
+    model_router.begin(model_name, audio_seconds)
+    try:
+        model_lock = contextlib.nullcontext() if inference_pool is not None else get_model_lock(model_name)
+        with scheduler.slot(client_id, audio_seconds, cancel), model_lock:
+            if inference_pool is not None:
+                result, inference_time = inference_pool.transcribe(
+                    model_name, audio, transcribe_options, guard, on_window, cancel
+                )
+            else:
+                result, inference_time = run_transcribe(
+                    model_name, audio, transcribe_options, guard, on_window, cancel
+                )
+    except InferenceCancelled as e:
+        cancellation_stats.record(e.reason, audio_seconds, e.processed_seconds)
+        print(f"🛑 {e}（已解码 {e.processed_seconds:.1f}s / {audio_seconds:.1f}s）")
+        raise
+    finally:
+        model_router.end(model_name, audio_seconds, inference_time)
+    
+    processing_time = time.time() - start_time
+    print(f"✅ 转录完成，耗时: {processing_time:.2f}s")
+    
+    if routing is not None:
+        result["routing"] = routing
+    
+    if word_timestamps:
+        print(f"⏱️  词级对齐耗时: {result['alignment_time']:.2f}s")
+    
+    return result, processing_time
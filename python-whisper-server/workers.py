@@ -0,0 +1,292 @@
+"""多进程推理：解码后的音频放入共享内存，工作进程只接收描述信息
+
+默认推理在 HTTP 进程的线程池中进行。设置 WHISPER_INFERENCE_WORKERS 后改为在独立进程中推理，
+每个工作进程各自加载模型。几十 MB 的 float32 音频如果随任务参数一起 pickle 经管道传输，
+会占用大量吞吐，因此音频只写入一次 multiprocessing.shared_memory，
+工作进程按名字映射同一块内存直接使用；请求结束（成功、失败或取消）后由 HTTP 进程回收。
+工作进程只导入推理核心（inference.py），不会导入 main.py 再创建一遍应用、调度器和进程池。
+音频之后多留一个字节作为取消标记，HTTP 进程写入，工作进程在每个窗口解码前读取。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cancellation import (
+    CANCEL_POLL_SECONDS, REASON_DEADLINE, REASON_DISCONNECTED, CancelToken, InferenceCancelled
+)
+from decoding import encoder_cache, guard_stats
+from inference import get_model_lock, load_model, model_cache, run_transcribe
+
+# 推理工作进程数，0 表示在 HTTP 进程内推理
+INFERENCE_WORKERS = int(os.environ.get("WHISPER_INFERENCE_WORKERS", "0"))
+
+# 取消标记字节的取值
+CANCEL_FLAGS = {REASON_DISCONNECTED: 1, REASON_DEADLINE: 2}
+
+
+class SharedAudioBlocks:
+    """HTTP 进程持有的共享内存块，负责创建和回收"""
+
+    def __init__(self):
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.created = 0
+        self.released = 0
+
+    def put(self, audio: np.ndarray) -> Dict[str, Any]:
+        """把音频写入新的共享内存块，返回传给工作进程的描述信息"""
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        block = shared_memory.SharedMemory(create=True, size=audio.nbytes + 1)
+        np.ndarray(audio.shape, dtype=np.float32, buffer=block.buf)[:] = audio
+        block.buf[audio.nbytes] = 0
+        with self._lock:
+            self._blocks[block.name] = block
+            self.bytes += block.size
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self.created += 1
+        return {"name": block.name, "samples": len(audio)}
+
+    def cancel(self, descriptor: Dict[str, Any], reason: str):
+        """写入取消标记，工作进程在下一个窗口解码前停止"""
+        with self._lock:
+            block = self._blocks.get(descriptor["name"])
+            if block is not None:
+                block.buf[descriptor["samples"] * 4] = CANCEL_FLAGS.get(reason, 1)
+
+    def release(self, descriptor: Dict[str, Any]):
+        with self._lock:
+            block = self._blocks.pop(descriptor["name"], None)
+            if block is None:
+                return
+            self.bytes -= block.size
+            self.released += 1
+        block.close()
+        block.unlink()
+
+    def release_all(self):
+        with self._lock:
+            names = list(self._blocks)
+        for name in names:
+            self.release({"name": name})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "live": len(self._blocks),
+                "bytes": self.bytes,
+                "peakBytes": self.peak_bytes,
+                "created": self.created,
+                "released": self.released
+            }
+
+
+class SharedFlagToken(CancelToken):
+    """工作进程一侧的取消标记，读取共享内存块末尾的标记字节"""
+
+    def __init__(self, block: shared_memory.SharedMemory, offset: int):
+        super().__init__()
+        self._block = block
+        self._offset = offset
+
+    def cancelled_reason(self) -> Optional[str]:
+        if self.reason is None:
+            flag = self._block.buf[self._offset]
+            for reason, value in CANCEL_FLAGS.items():
+                if flag == value:
+                    self.reason = reason
+        return self.reason
+
+
+def worker_init(preload_models: List[str]):
+    """工作进程启动时预加载模型"""
+    for model_name in preload_models:
+        with get_model_lock(model_name):
+            load_model(model_name)
+
+
+def worker_transcribe(model_name: str, descriptor: Dict[str, Any], transcribe_options: Dict[str, Any],
+                      guard, progress_queue) -> Tuple[Dict[str, Any], float, List[str], Tuple, int, Dict[str, Any]]:
+    """在工作进程中转写共享内存里的音频
+
+    返回 (结果, 推理耗时, 已加载的模型, 截断计数, 进程号, 编码器缓存统计)
+    """
+    on_window = None
+    if progress_queue is not None:
+        on_window = lambda segments, processed: progress_queue.put((segments, processed))
+
+    block = shared_memory.SharedMemory(name=descriptor["name"])
+    try:
+        audio = np.ndarray((descriptor["samples"],), dtype=np.float32, buffer=block.buf)
+        cancel = SharedFlagToken(block, descriptor["samples"] * 4)
+        try:
+            result, inference_time = run_transcribe(model_name, audio, transcribe_options, guard, on_window, cancel)
+        finally:
+            del audio
+        return result, inference_time, list(model_cache), guard_stats.take(), os.getpid(), encoder_cache.stats()
+    finally:
+        try:
+            block.close()
+        except BufferError:
+            # 异常回溯仍引用着这块内存时无法立即解除映射，进程回收对象时会自动释放
+            pass
+
+
+class InferencePool:
+    """推理工作进程池；进程用 spawn 方式启动，避免 fork 已初始化的 torch / CUDA 状态"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, preload_models: Optional[List[str]] = None):
+        self.workers = workers
+        self.preload_models = preload_models or []
+        self.blocks = SharedAudioBlocks()
+        self.models: List[str] = []
+        self.restarts = 0
+        self.recycles = 0
+        # 各工作进程最近一次上报的编码器缓存统计，按进程号保存
+        self.encoder_caches: Dict[int, Dict[str, Any]] = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=self._context,
+                    initializer=worker_init,
+                    initargs=(self.preload_models,)
+                )
+            return self._executor
+
+    def _get_manager(self):
+        # 进度消息需要跨进程队列，只在首次请求进度时启动 Manager
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._context.Manager()
+            return self._manager
+
+    def start(self):
+        """启动全部工作进程并等待模型预加载完成"""
+        executor = self._get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        self.models = sorted(set(self.models) | set(self.preload_models))
+
+    def transcribe(self, model_name: str, audio: np.ndarray, transcribe_options: Dict[str, Any],
+                   guard=None, on_window: Optional[Callable] = None,
+                   cancel: Optional[CancelToken] = None) -> Tuple[Dict[str, Any], float]:
+        descriptor = self.blocks.put(audio)
+        progress_queue = None
+        drain = None
+        try:
+            if on_window is not None:
+                progress_queue = self._get_manager().Queue()
+                drain = threading.Thread(target=self._drain, args=(progress_queue, on_window), daemon=True)
+                drain.start()
+
+            executor = self._get_executor()
+            future = executor.submit(
+                worker_transcribe, model_name, descriptor, transcribe_options, guard, progress_queue
+            )
+            try:
+                result, inference_time, models, guard_counts, pid, cache_stats = self._wait(future, descriptor, cancel)
+            except BrokenProcessPool:
+                # 工作进程异常退出，下次请求时重建进程池
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                        self.encoder_caches = {}
+                        self.restarts += 1
+                raise
+            except BaseException:
+                future.cancel()
+                raise
+            with self._lock:
+                if self._executor is executor:
+                    # 回收前提交的任务返回时，不再把旧进程的模型和缓存计入
+                    self.models = sorted(set(self.models) | set(models))
+                    self.encoder_caches[pid] = cache_stats
+            guard_stats.add(guard_counts)
+            return result, inference_time
+        finally:
+            if progress_queue is not None:
+                progress_queue.put(None)
+                drain.join()
+            self.blocks.release(descriptor)
+
+    def _wait(self, future, descriptor: Dict[str, Any], cancel: Optional[CancelToken]):
+        """等待工作进程返回；请求被取消时，未开始的任务直接撤回，已开始的通过标记字节通知"""
+        if cancel is None:
+            return future.result()
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_SECONDS)
+            except FutureTimeoutError:
+                reason = cancel.cancelled_reason()
+                if reason is None:
+                    continue
+                if future.cancel():
+                    raise InferenceCancelled(reason)
+                self.blocks.cancel(descriptor, reason)
+                # 工作进程会在下一个窗口前抛出 InferenceCancelled，继续等待它返回
+                return future.result()
+
+    @staticmethod
+    def _drain(progress_queue, on_window: Callable):
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                break
+            on_window(*item)
+
+    def recycle(self):
+        """回收全部工作进程，释放各进程中的模型和编码器缓存；下次请求时重新启动进程
+
+        已提交的任务在旧进程中继续执行完毕，旧进程随后退出
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self.models = []
+            self.encoder_caches = {}
+            self.recycles += 1
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def encoder_cache_stats(self) -> Dict[str, Any]:
+        """汇总各工作进程的编码器缓存统计，字段与 EncoderCache.stats() 相同"""
+        with self._lock:
+            caches = list(self.encoder_caches.values())
+        totals = {key: sum(cache[key] for cache in caches)
+                  for key in ("entries", "bytes", "maxBytes", "hits", "misses", "evictions")}
+        lookups = totals["hits"] + totals["misses"]
+        totals["hitRate"] = round(totals["hits"] / lookups, 4) if lookups else 0
+        totals["workers"] = len(caches)
+        return totals
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            manager, self._manager = self._manager, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+        self.blocks.release_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "models": self.models,
+            "restarts": self.restarts,
+            "recycles": self.recycles,
+            "sharedMemory": self.blocks.stats()
+        }